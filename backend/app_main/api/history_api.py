@@ -3,8 +3,14 @@
 聊天历史和对话线程管理相关的API接口
 """
 
-from fastapi import APIRouter, HTTPException, Request
-from app_main.auth import _auth_user_from_request
+import json
+from typing import Any, Dict, Optional, Tuple
+from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks
+from fastapi.responses import Response
+from app_main.auth import current_user
+from app_main.ttl_cache import TTLCache
+from app_main.responses import FastJSONResponse
+from app_main.api.share_api import invalidate_shared_chat
 
 # 创建路由器
 history_router = APIRouter(prefix="/api", tags=["history"])
@@ -12,47 +18,92 @@ history_router = APIRouter(prefix="/api", tags=["history"])
 # 需要从main.py注入的依赖
 chat_db = None
 
+# 历史分页窗口缓存：key=(username, session_id, conversation_id, limit, offset) -> (data, total, returned)
+# data 为数据库内拼装好的 JSON 数组字节，直接拼入响应体
+# 返回当前页后预取下一页，翻页时直接命中；TTL 很短，新消息写入后最多延迟数秒可见
+HISTORY_PREFETCH_TTL_SECONDS = 10
+_history_window_cache = TTLCache(maxsize=512, ttl=HISTORY_PREFETCH_TTL_SECONDS)
+# 正在预取的窗口，避免重复发起
+_prefetch_inflight = set()
+
 def init_history_dependencies(database):
     """初始化历史API的依赖"""
     global chat_db
     chat_db = database
 
+def invalidate_history_cache(session_id: Optional[str] = None):
+    """会话记录被清空或删除时调用；不传 session_id 则清空全部。"""
+    if session_id is None:
+        _history_window_cache.clear()
+    else:
+        _history_window_cache.pop_where(lambda key: key[1] in (session_id, None))
+
+async def _load_history_window(key: Tuple) -> Tuple[bytes, int, int]:
+    username, session_id, conversation_id, limit, offset = key
+    return await chat_db.get_history_json_with_total(
+        username=username,
+        limit=limit,
+        conversation_id=conversation_id,
+        session_id=session_id,
+        offset=offset,
+    )
+
+async def _prefetch_next(key: Tuple):
+    """后台预取下一页窗口写入缓存（失败静默，不影响正常请求）。"""
+    if key in _prefetch_inflight or _history_window_cache.get(key) is not None:
+        return
+    _prefetch_inflight.add(key)
+    try:
+        window = await _load_history_window(key)
+        if window[2]:
+            _history_window_cache.set(key, window)
+    except Exception as e:
+        print(f"⚠️ 预取历史记录失败: {e}")
+    finally:
+        _prefetch_inflight.discard(key)
+
 @history_router.get("/history")
-async def get_history(limit: int = 50, session_id: str = None, conversation_id: int = None, request: Request = None):
-    """获取聊天历史：强制按JWT用户过滤，不接受用户名查询参数。"""
+async def get_history(background_tasks: BackgroundTasks, limit: int = 50, offset: int = 0, session_id: str = None, conversation_id: int = None, user: Dict[str, Any] = Depends(current_user)):
+    """获取聊天历史：强制按JWT用户过滤，不接受用户名查询参数。
+    未指定 conversation_id 时支持 offset 向更早的记录翻页，并在响应返回后预取下一页。
+    """
     if not chat_db:
         raise HTTPException(status_code=503, detail="数据库未初始化")
     
     try:
-        user = _auth_user_from_request(request)
-        records = await chat_db.get_chat_history_by_user(
-            username=user["username"],
-            limit=limit,
-            conversation_id=conversation_id,
-            session_id=session_id,
-        )
+        offset = max(0, offset) if conversation_id is None else 0
+        key = (user["username"], session_id, conversation_id, limit, offset)
+        cached = _history_window_cache.pop(key)
+        if cached is not None:
+            data, total, returned = cached
+        else:
+            # 记录（已编码的 JSON 数组）与该用户匹配总数在同一次查询中取回
+            data, total, returned = await _load_history_window(key)
         
-        # 获取统计信息
-        stats = await chat_db.get_stats()
+        has_more = total > offset + returned
+        if has_more and conversation_id is None:
+            background_tasks.add_task(_prefetch_next, key[:4] + (offset + limit,))
         
-        return {
-            "success": True,
-            "data": records,
-            "total": stats.get("total_records", 0),
-            "returned": len(records),
+        # 记录数组原样拼入响应体，其余字段照常编码（字段顺序与之前一致）
+        meta = json.dumps({
+            "total": total,
+            "returned": returned,
+            "offset": offset,
+            "has_more": has_more,
             "session_id": session_id,
             "conversation_id": conversation_id
-        }
+        }, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        body = b'{"success":true,"data":' + data + b"," + meta[1:]
+        return Response(content=body, media_type="application/json")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取历史记录失败: {str(e)}")
 
-@history_router.get("/threads")
-async def get_threads(limit: int = 100, request: Request = None):
+@history_router.get("/threads", response_class=FastJSONResponse)
+async def get_threads(limit: int = 100, user: Dict[str, Any] = Depends(current_user)):
     """获取当前登录用户的对话线程列表（基于JWT，禁止明文用户名参数）。"""
     if not chat_db:
         raise HTTPException(status_code=503, detail="数据库未初始化")
     try:
-        user = _auth_user_from_request(request)
         threads = await chat_db.get_threads_by_username(username=user["username"], limit=limit)
         return {"success": True, "data": threads}
     except Exception as e:
@@ -68,9 +119,13 @@ async def clear_history(session_id: str = None):
         # 如果没有提供session_id，则清空所有历史（保持向后兼容）
         if session_id:
             success = await chat_db.clear_history(session_id=session_id)
+            invalidate_shared_chat(session_id)
+            invalidate_history_cache(session_id)
             message = f"会话 {session_id} 的聊天历史已清空"
         else:
             success = await chat_db.clear_history()
+            invalidate_shared_chat()
+            invalidate_history_cache()
             message = "所有聊天历史已清空"
         
         if success:
@@ -87,6 +142,8 @@ async def delete_thread(session_id: str, conversation_id: int):
         raise HTTPException(status_code=503, detail="数据库未初始化")
     try:
         ok = await chat_db.delete_conversation(session_id=session_id, conversation_id=conversation_id)
+        invalidate_shared_chat(session_id)
+        invalidate_history_cache(session_id)
         if ok:
             return {"success": True}
         raise HTTPException(status_code=500, detail="删除对话线程失败")
@@ -5,8 +5,11 @@
 
 from typing import Dict, Any
 from datetime import datetime
-from fastapi import APIRouter, HTTPException, Request, Body
-from app_main.auth import _auth_user_from_request
+from fastapi import APIRouter, HTTPException, Body, Depends
+from fastapi.responses import Response
+from app_main.auth import current_user
+from app_main.ttl_cache import TTLCache
+from app_main.responses import FastJSONResponse
 
 # 创建路由器
 share_router = APIRouter(prefix="/api", tags=["share"])
@@ -14,30 +17,45 @@ share_router = APIRouter(prefix="/api", tags=["share"])
 # 需要从main.py注入的依赖
 chat_db = None
 
+# 分享快照不可变：缓存已编码好的响应体，长TTL
+_snapshot_cache = TTLCache(maxsize=1024, ttl=6 * 3600)
+# 会话分享只读但可能被删除/清空：按 (session_id, limit) 缓存记录，短TTL + 主动失效
+_shared_chat_cache = TTLCache(maxsize=1024, ttl=30)
+
 def init_share_dependencies(database):
     """初始化分享API的依赖"""
     global chat_db
     chat_db = database
 
-@share_router.get("/share/{session_id}")
+
+def invalidate_shared_chat(session_id: str = None):
+    """会话记录被清空或删除时调用；不传 session_id 则清空全部。"""
+    if session_id is None:
+        _shared_chat_cache.clear()
+    else:
+        _shared_chat_cache.pop_where(lambda key: key[0] == session_id)
+
+@share_router.get("/share/{session_id}", response_class=FastJSONResponse)
 async def get_shared_chat(session_id: str, limit: int = 100):
     """获取分享的聊天记录（只读）"""
     if not chat_db:
         raise HTTPException(status_code=503, detail="数据库未初始化")
     
     try:
-        # 获取指定会话的聊天历史
-        records = await chat_db.get_chat_history(
-            session_id=session_id, 
-            limit=limit
-        )
+        cache_key = (session_id, limit)
+        records = _shared_chat_cache.get(cache_key)
+        if records is None:
+            # 获取指定会话的聊天历史
+            records = await chat_db.get_chat_history(
+                session_id=session_id, 
+                limit=limit
+            )
+            if records:
+                _shared_chat_cache.set(cache_key, records)
         
         if not records:
             raise HTTPException(status_code=404, detail="未找到该会话的聊天记录")
         
-        # 获取会话统计信息
-        stats = await chat_db.get_stats()
-        
         return {
             "success": True,
             "data": records,
@@ -52,36 +70,28 @@ async def get_shared_chat(session_id: str, limit: int = 100):
         raise HTTPException(status_code=500, detail=f"获取分享聊天记录失败: {str(e)}")
 
 @share_router.post("/share/create")
-async def create_share_snapshot(request: Request, payload: Dict[str, Any] = Body(default={})):
+async def create_share_snapshot(payload: Dict[str, Any] = Body(default={}), user: Dict[str, Any] = Depends(current_user)):
     """创建只读分享快照，返回 share_id。
     支持字段：session_id（可选，默认当前连接最近使用）/ conversation_id（可选）/ limit（默认100）
     备注：为提升安全性，仅允许已登录用户创建快照，并将快照与创建者关联。
     """
     if not chat_db:
         raise HTTPException(status_code=503, detail="数据库未初始化")
-    try:
-        user = _auth_user_from_request(request)
-    except HTTPException:
-        raise
-    except Exception:
-        raise HTTPException(status_code=401, detail="未认证")
 
     try:
         session_id = str((payload or {}).get("session_id") or "default").strip() or "default"
         limit = int((payload or {}).get("limit") or 100)
         conversation_id = (payload or {}).get("conversation_id")
-        # 仅导出当前用户的记录
-        records = await chat_db.get_chat_history_by_user(
+        # 仅导出当前用户的记录；查询与写入快照在数据库内一步完成
+        share_id = await chat_db.create_shared_snapshot_from_query(
             username=user["username"],
-            limit=limit,
-            conversation_id=conversation_id,
             session_id=session_id,
+            conversation_id=conversation_id,
+            limit=limit,
+            created_by_user_id=user["id"],
         )
-        if not records:
-            raise HTTPException(status_code=404, detail="没有可分享的记录")
-        share_id = await chat_db.create_shared_snapshot(records, created_by_user_id=user["id"], created_by_username=user["username"])
         if not share_id:
-            raise HTTPException(status_code=500, detail="创建分享失败")
+            raise HTTPException(status_code=404, detail="没有可分享的记录")
         return {"success": True, "share_id": share_id}
     except HTTPException:
         raise
@@ -94,10 +104,14 @@ async def get_share_snapshot(share_id: str):
     if not chat_db:
         raise HTTPException(status_code=503, detail="数据库未初始化")
     try:
-        records = await chat_db.get_shared_snapshot(share_id)
-        if not records:
-            raise HTTPException(status_code=404, detail="分享不存在或已删除")
-        return {"success": True, "data": records, "share_id": share_id, "readonly": True}
+        body = _snapshot_cache.get(share_id)
+        if body is None:
+            # 创建快照时已预编码好响应体，直接透传
+            body = await chat_db.get_shared_snapshot_payload(share_id)
+            if not body:
+                raise HTTPException(status_code=404, detail="分享不存在或已删除")
+            _snapshot_cache.set(share_id, body)
+        return Response(content=body, media_type="application/json")
     except HTTPException:
         raise
     except Exception as e:
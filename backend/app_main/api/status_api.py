@@ -6,8 +6,12 @@
 from datetime import datetime
 import os
 import json
+import time
+import asyncio
+from typing import Any, Dict, List, Tuple
 from fastapi import APIRouter, HTTPException, Request
-from app_main.auth import _auth_user_from_request, get_chat_db
+from app_main.auth import _auth_user_from_request
+from app_main.db_pool import acquire_reader
 from app_main.connection import ConnectionManager
 import random
 
@@ -19,6 +23,19 @@ mcp_agent = None
 chat_db = None
 manager = None
 
+# 统计信息短TTL缓存：轮询场景下避免每次请求都对 chat_records 做 COUNT
+try:
+    STATS_TTL_SECONDS = float(os.getenv("STATS_TTL_SECONDS", "3"))
+except Exception:
+    STATS_TTL_SECONDS = 3.0
+_stats_cache: Dict[str, Any] = {"at": 0.0, "val": None}
+_stats_lock = asyncio.Lock()
+
+# 用户自定义模型下拉项缓存：user_id -> (写入时间, 已组装好的响应条目)
+# 由 user_models_api 的增删改接口主动失效，TTL 仅作兜底
+USER_MODELS_CACHE_TTL_SECONDS = 30.0
+_user_models_cache: Dict[int, Tuple[float, List[Dict[str, Any]]]] = {}
+
 def init_status_dependencies(agent, database, connection_manager):
     """初始化状态API的依赖"""
     global mcp_agent, chat_db, manager
@@ -26,6 +43,56 @@ def init_status_dependencies(agent, database, connection_manager):
     chat_db = database
     manager = connection_manager
 
+
+async def _cached_stats() -> Dict[str, Any]:
+    """返回数据库统计信息（带TTL缓存，并发刷新时仅查询一次）。"""
+    if not chat_db:
+        return {}
+    val = _stats_cache["val"]
+    if val is not None and time.monotonic() - _stats_cache["at"] < STATS_TTL_SECONDS:
+        return val
+    async with _stats_lock:
+        # 等锁期间可能已被其他请求刷新
+        val = _stats_cache["val"]
+        if val is not None and time.monotonic() - _stats_cache["at"] < STATS_TTL_SECONDS:
+            return val
+        val = await chat_db.get_stats()
+        # get_stats 失败时返回空字典，不缓存失败结果
+        if val:
+            _stats_cache["val"] = val
+            _stats_cache["at"] = time.monotonic()
+        return val
+
+
+def invalidate_user_models_cache(user_id: int) -> None:
+    """用户自定义模型发生变更时调用，丢弃该用户的下拉项缓存。"""
+    _user_models_cache.pop(int(user_id), None)
+
+
+async def _user_model_options(user_id: int) -> List[Dict[str, Any]]:
+    cached = _user_models_cache.get(user_id)
+    if cached and time.monotonic() - cached[0] < USER_MODELS_CACHE_TTL_SECONDS:
+        return cached[1]
+    async with acquire_reader() as db:
+        async with db.execute(
+            "SELECT id, label, model FROM user_models WHERE user_id = ? ORDER BY id DESC",
+            (user_id,)
+        ) as cur:
+            rows = await cur.fetchall()
+    extra = [
+        {
+            "id": f"user-{r['id']}",
+            "label": r["label"],
+            "model": r["model"],
+            "is_default": False,
+            "type": "model",
+            "is_agent": False,
+        }
+        for r in rows
+    ]
+    _user_models_cache[user_id] = (time.monotonic(), extra)
+    return extra
+
 @status_router.get("/models")
 async def get_models(request: Request):
     """获取可选的大模型档位列表（用于前端下拉选择）。"""
@@ -36,24 +103,7 @@ async def get_models(request: Request):
         # 合并用户自定义模型（需要登录）
         try:
             user = _auth_user_from_request(request)
-            chat_db = get_chat_db()
-            import aiosqlite
-            extra = []
-            async with aiosqlite.connect(chat_db.db_path) as db:
-                cur = await db.execute(
-                    "SELECT id, label, model, enabled FROM user_models WHERE user_id = ? ORDER BY id DESC",
-                    (int(user["id"]),)
-                )
-                rows = await cur.fetchall()
-                for r in rows:
-                    extra.append({
-                        "id": f"user-{int(r[0])}",
-                        "label": r[1],
-                        "model": r[2],
-                        "is_default": False,
-                        "type": "model",
-                        "is_agent": False,
-                    })
+            extra = await _user_model_options(int(user["id"]))
             base["models"] = (base.get("models") or []) + extra
         except HTTPException:
             pass
@@ -102,30 +152,36 @@ async def get_quick_prompts(limit: int = 4):
     }
 
 @status_router.get("/status")
-async def get_status():
-    """获取系统状态"""
-    # 获取数据库统计信息
-    db_stats = {}
-    if chat_db:
-        try:
-            db_stats = await chat_db.get_stats()
-        except Exception as e:
-            print(f"⚠️ 获取数据库统计失败: {e}")
-    
-    return {
-        "success": True,
-        "data": {
-            "agent_initialized": mcp_agent is not None,
-            "database_initialized": chat_db is not None,
-            "tools_count": len(mcp_agent.tools) if mcp_agent else 0,
-            "active_connections": len(manager.active_connections) if manager else 0,
+async def get_status(include_db: bool = False):
+    """获取系统状态。
+
+    默认只返回进程内状态，不访问数据库；传 include_db=true 时附带（缓存的）数据库统计。
+    """
+    data = {
+        "agent_initialized": mcp_agent is not None,
+        "database_initialized": chat_db is not None,
+        "tools_count": len(mcp_agent.tools) if mcp_agent else 0,
+        "active_connections": len(manager.active_connections) if manager else 0,
+    }
+    if include_db:
+        # 获取数据库统计信息
+        db_stats = {}
+        if chat_db:
+            try:
+                db_stats = await _cached_stats()
+            except Exception as e:
+                print(f"⚠️ 获取数据库统计失败: {e}")
+        data.update({
             "chat_records_count": db_stats.get("total_records", 0),
             "chat_sessions_count": db_stats.get("total_sessions", 0),
             "chat_conversations_count": db_stats.get("total_conversations", 0),
             "latest_record": db_stats.get("latest_record"),
             "database_path": db_stats.get("database_path"),
-            "timestamp": datetime.now().isoformat()
-        }
+        })
+    data["timestamp"] = datetime.now().isoformat()
+    return {
+        "success": True,
+        "data": data
     }
 
 @status_router.get("/database/stats")
@@ -135,7 +191,7 @@ async def get_database_stats():
         raise HTTPException(status_code=503, detail="数据库未初始化")
     
     try:
-        stats = await chat_db.get_stats()
+        stats = await _cached_stats()
         return {
             "success": True,
             "data": stats
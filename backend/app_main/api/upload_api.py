@@ -4,15 +4,55 @@
 """
 
 import os
-import uuid
-from datetime import datetime
+import time
+import secrets
+from typing import BinaryIO
 from fastapi import APIRouter, UploadFile, File, HTTPException
+from starlette.concurrency import run_in_threadpool
 
 # 创建路由器
 upload_router = APIRouter(prefix="/api", tags=["upload"])
 
 # 上传目录配置
 UPLOADS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "uploads")
+# 单文件大小限制：20MB
+MAX_UPLOAD_BYTES = 20 * 1024 * 1024
+# 分块写盘大小，避免整个文件读入内存
+UPLOAD_CHUNK_SIZE = 1 << 20
+# 已确认存在的日期子目录，避免每次上传都 makedirs/stat
+_created_dirs: set = set()
+# 允许上传的扩展名（小写，含点）：图片、文档与表格数据；其余一律拒绝（如 .php/.html/.exe）
+_ALLOWED_EXTS = frozenset({
+    ".png", ".jpg", ".jpeg", ".gif", ".webp",
+    ".pdf", ".txt", ".md", ".json", ".xml",
+    ".csv", ".xls", ".xlsx", ".doc", ".docx",
+})
+
+
+class _UploadTooLarge(Exception):
+    pass
+
+
+def _copy_limited(src: BinaryIO, target_path: str, max_bytes: int) -> int:
+    """在线程池中把上传临时文件分块拷贝到目标路径；超限抛 _UploadTooLarge，失败时删除半成品。"""
+    total = 0
+    try:
+        with open(target_path, "wb") as out:
+            while True:
+                chunk = src.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                total += len(chunk)
+                if total > max_bytes:
+                    raise _UploadTooLarge()
+                out.write(chunk)
+    except BaseException:
+        try:
+            os.unlink(target_path)
+        except OSError:
+            pass
+        raise
+    return total
 
 @upload_router.post("/upload")
 async def upload_file(file: UploadFile = File(...)):
@@ -20,22 +60,31 @@ async def upload_file(file: UploadFile = File(...)):
     try:
         # 基础校验与限制（可按需调整）
         original_name = file.filename or "file"
-        ext = os.path.splitext(original_name)[1]
+        # 扩展名白名单校验，在任何磁盘写入之前完成
+        head, dot, tail = original_name.rpartition(".")
+        ext = f".{tail.lower()}" if dot and head else ""
+        if ext not in _ALLOWED_EXTS:
+            raise HTTPException(status_code=400, detail=f"Unsupported file type: {ext or '(none)'}")
+        # 解析阶段已知大小时，先行拒绝，避免任何磁盘写入
+        if file.size is not None and file.size > MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=400, detail="File too large (max 20MB)")
         # 生成唯一文件名，避免重复
-        unique_name = f"{uuid.uuid4().hex}{ext}"
+        unique_name = f"{secrets.token_hex(16)}{ext}"
 
         # 使用日期子目录，便于管理
-        date_dir = datetime.now().strftime("%Y%m%d")
+        date_dir = time.strftime("%Y%m%d")
         target_dir = os.path.join(UPLOADS_DIR, date_dir)
-        os.makedirs(target_dir, exist_ok=True)
+        if date_dir not in _created_dirs:
+            os.makedirs(target_dir, exist_ok=True)
+            _created_dirs.add(date_dir)
 
         target_path = os.path.join(target_dir, unique_name)
-        content = await file.read()
-        # 简单大小限制：20MB
-        if len(content) > 20 * 1024 * 1024:
+        # 在线程池中流式拷贝（不阻塞事件循环），超过大小限制立即中止并删除半成品文件
+        try:
+            await file.seek(0)
+            await run_in_threadpool(_copy_limited, file.file, target_path, MAX_UPLOAD_BYTES)
+        except _UploadTooLarge:
             raise HTTPException(status_code=400, detail="File too large (max 20MB)")
-        with open(target_path, "wb") as f:
-            f.write(content)
 
         # 返回静态访问路径（相对API根路径）
         url_path = f"/uploads/{date_dir}/{unique_name}"
@@ -1,76 +1,86 @@
-from typing import Dict, Any
-from fastapi import APIRouter, HTTPException, Request, Body
+import functools
+from typing import Dict, Any, Tuple
 
-from app_main.auth import _auth_user_from_request, get_chat_db
+from fastapi import APIRouter, HTTPException, Body, Depends
+
+from app_main.auth import current_user, get_chat_db
+from app_main.db_pool import acquire_reader, get_writer
+from app_main.api.status_api import invalidate_user_models_cache
+from app_main.responses import FastJSONResponse
 
 user_models_router = APIRouter(prefix="/api/user", tags=["user_models"])
 
+# 允许通过 PUT 更新的字段（同时决定 SET 子句的固定顺序）
+_UPDATABLE_FIELDS = ("profile_id", "label", "api_key", "base_url", "model", "temperature", "timeout", "system_prompt", "enabled")
+
+_INSERT_SQL = """
+    INSERT INTO user_models (user_id, profile_id, label, api_key, base_url, model, temperature, timeout, system_prompt, enabled)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+@functools.lru_cache(maxsize=128)
+def _build_update_sql(fields: Tuple[str, ...]) -> str:
+    """按字段组合生成 UPDATE 语句；相同组合复用同一条 SQL 文本，便于 SQLite 语句缓存命中。"""
+    assignments = ", ".join(f"{k} = ?" for k in fields)
+    return f"UPDATE user_models SET {assignments}, updated_at = CURRENT_TIMESTAMP WHERE user_id = ? AND id = ?"
+
+
+def _coerce_update_value(key: str, value: Any) -> Any:
+    if key == "temperature":
+        return float(value)
+    if key == "timeout":
+        return int(value)
+    if key == "enabled":
+        return 0 if str(value).strip().lower() in {"0","false","no","off"} else 1
+    return (str(value) if value is not None else "").strip()
+
 
 def init_user_models_dependencies(chat_db):
     # 与其他模块保持一致风格；这里依赖 get_chat_db() 提供实例
     get_chat_db.instance = chat_db
 
 
-@user_models_router.get("/models")
-async def list_user_models(request: Request):
-    chat_db = get_chat_db()
-    user = _auth_user_from_request(request)
-    try:
-        # 确保表存在（幂等）
-        try:
-            await __import__('aiosqlite').connect  # noqa
-        except Exception:
-            pass
-        # 直接用数据库实例的路径
-        import aiosqlite
-        async with aiosqlite.connect(chat_db.db_path) as db:
-            cur = await db.execute(
-                """
-                CREATE TABLE IF NOT EXISTS user_models (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    profile_id TEXT,
-                    label TEXT NOT NULL,
-                    api_key TEXT NOT NULL,
-                    base_url TEXT,
-                    model TEXT NOT NULL,
-                    temperature REAL DEFAULT 0.2,
-                    timeout INTEGER DEFAULT 60,
-                    system_prompt TEXT,
-                    enabled INTEGER DEFAULT 1,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-                """
+async def init_user_models_schema(chat_db):
+    """创建 user_models 表及索引（幂等），在应用启动时调用一次，不放在请求路径上。"""
+    async with chat_db.writer() as db:
+        await db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS user_models (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                profile_id TEXT,
+                label TEXT NOT NULL,
+                api_key TEXT NOT NULL,
+                base_url TEXT,
+                model TEXT NOT NULL,
+                temperature REAL DEFAULT 0.2,
+                timeout INTEGER DEFAULT 60,
+                system_prompt TEXT,
+                enabled INTEGER DEFAULT 1,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
-            await db.execute("CREATE INDEX IF NOT EXISTS idx_user_models_user ON user_models(user_id)")
-            await db.execute("CREATE INDEX IF NOT EXISTS idx_user_models_profile ON user_models(user_id, profile_id)")
-            await db.commit()
+            """
+        )
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_user_models_user ON user_models(user_id)")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_user_models_profile ON user_models(user_id, profile_id)")
+        await db.commit()
 
-        # 查询
-        import aiosqlite
-        async with aiosqlite.connect(chat_db.db_path) as db:
-            cur = await db.execute(
+
+@user_models_router.get("/models", response_class=FastJSONResponse)
+async def list_user_models(user: Dict[str, Any] = Depends(current_user)):
+    try:
+        async with acquire_reader() as db:
+            async with db.execute(
                 """
                 SELECT id, profile_id, label, base_url, model, temperature, timeout, system_prompt, enabled
                 FROM user_models WHERE user_id = ? ORDER BY id DESC
                 """,
                 (int(user["id"]),)
-            )
-            rows = await cur.fetchall()
-            data = []
-            for r in rows:
-                data.append({
-                    "id": int(r[0]),
-                    "profile_id": r[1],
-                    "label": r[2],
-                    "base_url": r[3],
-                    "model": r[4],
-                    "temperature": r[5],
-                    "timeout": r[6],
-                    "system_prompt": r[7],
-                    "enabled": bool(r[8]),
-                })
+            ) as cur:
+                rows = await cur.fetchall()
+            data = [dict(r, enabled=bool(r["enabled"])) for r in rows]
         return {"success": True, "data": data}
     except HTTPException:
         raise
@@ -79,15 +89,12 @@ async def list_user_models(request: Request):
 
 
 @user_models_router.get("/tushare_token")
-async def get_tushare_token_status(request: Request):
+async def get_tushare_token_status(user: Dict[str, Any] = Depends(current_user)):
     """查询当前用户是否已设置 Tushare Token 和启用状态（不返回明文）。"""
-    chat_db = get_chat_db()
-    user = _auth_user_from_request(request)
     try:
-        import aiosqlite
-        async with aiosqlite.connect(chat_db.db_path) as db:
-            cur = await db.execute("SELECT tushare_token, tushare_token_enabled FROM users WHERE id = ?", (int(user["id"]),))
-            row = await cur.fetchone()
+        async with acquire_reader() as db:
+            async with db.execute("SELECT tushare_token, tushare_token_enabled FROM users WHERE id = ?", (int(user["id"]),)) as cur:
+                row = await cur.fetchone()
             token = row[0] if row else None
             enabled = bool(row[1]) if (row and len(row) > 1) else False
             return {
@@ -100,10 +107,9 @@ async def get_tushare_token_status(request: Request):
 
 
 @user_models_router.post("/tushare_token")
-async def set_tushare_token(request: Request, payload: dict = Body(default={})):  # { token?: string, clear?: boolean, enabled?: boolean }
+async def set_tushare_token(payload: dict = Body(default={}), user: Dict[str, Any] = Depends(current_user)):  # { token?: string, clear?: boolean, enabled?: boolean }
     """设置或清空当前用户的 Tushare Token，并可设置启用状态。"""
     chat_db = get_chat_db()
-    user = _auth_user_from_request(request)
     token = (payload or {}).get("token")
     clear = str((payload or {}).get("clear", "")).strip().lower() in {"1", "true", "yes", "on"}
     enabled = payload.get("enabled")  # 可选：启用/禁用
@@ -151,9 +157,7 @@ async def set_tushare_token(request: Request, payload: dict = Body(default={})):
 
 
 @user_models_router.post("/models")
-async def create_user_model(request: Request, payload: Dict[str, Any]):
-    chat_db = get_chat_db()
-    user = _auth_user_from_request(request)
+async def create_user_model(payload: Dict[str, Any], user: Dict[str, Any] = Depends(current_user)):
     label = (payload or {}).get("label", "").strip()
     api_key = (payload or {}).get("api_key", "").strip()
     model = (payload or {}).get("model", "").strip()
@@ -166,70 +170,48 @@ async def create_user_model(request: Request, payload: Dict[str, Any]):
     system_prompt = (payload or {}).get("system_prompt", "").strip()
     enabled = 1 if str((payload or {}).get("enabled", 1)).strip().lower() not in {"0","false","no","off"} else 0
     try:
-        import aiosqlite
-        async with aiosqlite.connect(chat_db.db_path) as db:
-            await db.execute(
-                """
-                INSERT INTO user_models (user_id, profile_id, label, api_key, base_url, model, temperature, timeout, system_prompt, enabled)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """,
+        async with get_writer() as db:
+            cur = await db.execute(
+                _INSERT_SQL,
                 (int(user["id"]), profile_id, label, api_key, base_url, model, temperature, timeout, system_prompt, enabled)
             )
-            cur = await db.execute("SELECT last_insert_rowid()")
-            row = await cur.fetchone()
+            new_id = cur.lastrowid
+            await cur.close()
             await db.commit()
-            new_id = int(row[0]) if row else None
+        invalidate_user_models_cache(user["id"])
         return {"success": True, "id": new_id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"创建失败: {e}")
 
 
 @user_models_router.put("/models/{model_id}")
-async def update_user_model(model_id: int, request: Request, payload: Dict[str, Any]):
-    chat_db = get_chat_db()
-    user = _auth_user_from_request(request)
-    allowed = {"profile_id","label","api_key","base_url","model","temperature","timeout","system_prompt","enabled"}
-    fields = []
-    params = []
-    for k, v in (payload or {}).items():
-        if k in allowed:
-            fields.append(f"{k} = ?")
-            if k == "temperature":
-                params.append(float(v))
-            elif k == "timeout":
-                params.append(int(v))
-            elif k == "enabled":
-                params.append(0 if str(v).strip().lower() in {"0","false","no","off"} else 1)
-            else:
-                params.append((str(v) if v is not None else "").strip())
+async def update_user_model(model_id: int, payload: Dict[str, Any], user: Dict[str, Any] = Depends(current_user)):
+    payload = payload or {}
+    fields = tuple(k for k in _UPDATABLE_FIELDS if k in payload)
     if not fields:
         return {"success": True}
+    params = [_coerce_update_value(k, payload[k]) for k in fields]
     params.extend([int(user["id"]), int(model_id)])
     try:
-        import aiosqlite
-        async with aiosqlite.connect(chat_db.db_path) as db:
-            await db.execute(
-                f"UPDATE user_models SET {', '.join(fields)}, updated_at = CURRENT_TIMESTAMP WHERE user_id = ? AND id = ?",
-                tuple(params)
-            )
+        async with get_writer() as db:
+            await db.execute(_build_update_sql(fields), tuple(params))
             await db.commit()
+        invalidate_user_models_cache(user["id"])
         return {"success": True}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"更新失败: {e}")
 
 
 @user_models_router.delete("/models/{model_id}")
-async def delete_user_model(model_id: int, request: Request):
-    chat_db = get_chat_db()
-    user = _auth_user_from_request(request)
+async def delete_user_model(model_id: int, user: Dict[str, Any] = Depends(current_user)):
     try:
-        import aiosqlite
-        async with aiosqlite.connect(chat_db.db_path) as db:
+        async with get_writer() as db:
             await db.execute(
                 "DELETE FROM user_models WHERE user_id = ? AND id = ?",
                 (int(user["id"]), int(model_id))
             )
             await db.commit()
+        invalidate_user_models_cache(user["id"])
         return {"success": True}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"删除失败: {e}")
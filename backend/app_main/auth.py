@@ -4,20 +4,81 @@
 """
 
 import os
+import re
+import time
+import asyncio
+import hmac
+import base64
+import hashlib
+import ssl
+import json
+import secrets
 import smtplib
-from typing import Dict, Any
-from datetime import datetime
+import threading
+from typing import Annotated, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
 from email.mime.text import MIMEText
 from email.utils import formataddr
 
-from fastapi import APIRouter, HTTPException, Request, Body
-import jwt as pyjwt
+from fastapi import APIRouter, HTTPException, Request, Body, Depends
+from pydantic import AfterValidator, BaseModel, ConfigDict
 from passlib.context import CryptContext
 
+from app_main.ttl_cache import TTLCache
+from app_main.db_pool import get_writer
+from app_main.responses import FastJSONResponse
+
 # 认证配置
 JWT_SECRET = os.getenv("JWT_SECRET", "dev-secret-key-change-me")
 JWT_ALG = "HS256"
 pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
+# 直接调用 hashlib.pbkdf2_hmac（OpenSSL 实现，支持 SHA 指令扩展的 CPU 上会自动使用），
+# 生成与 passlib pbkdf2_sha256 完全兼容的 "$pbkdf2-sha256$轮数$盐$摘要" 格式
+PBKDF2_ROUNDS = pwd_context.handler("pbkdf2_sha256").default_rounds
+PBKDF2_SALT_BYTES = 16
+_PBKDF2_PREFIX = "$pbkdf2-sha256$"
+
+def _ab64_encode(data: bytes) -> str:
+    """passlib 使用的 adapted base64：'+' 换成 '.'，去掉填充。"""
+    return base64.b64encode(data).decode("ascii").rstrip("=").replace("+", ".")
+
+def _ab64_decode(data: str) -> bytes:
+    data = data.replace(".", "+")
+    return base64.b64decode(data + "=" * (-len(data) % 4))
+
+def _hash_password(password: str) -> str:
+    salt = os.urandom(PBKDF2_SALT_BYTES)
+    dk = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, PBKDF2_ROUNDS)
+    return f"{_PBKDF2_PREFIX}{PBKDF2_ROUNDS}${_ab64_encode(salt)}${_ab64_encode(dk)}"
+
+def _verify_password(password: str, password_hash: str) -> bool:
+    """校验密码；非 pbkdf2-sha256 格式的旧哈希交给 passlib 处理。"""
+    if not password_hash:
+        return False
+    if not password_hash.startswith(_PBKDF2_PREFIX):
+        try:
+            return pwd_context.verify(password, password_hash)
+        except Exception:
+            return False
+    try:
+        rounds, salt, checksum = password_hash[len(_PBKDF2_PREFIX):].split("$")
+        expected = _ab64_decode(checksum)
+        dk = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), _ab64_decode(salt), int(rounds), len(expected))
+    except Exception:
+        return False
+    return hmac.compare_digest(dk, expected)
+
+# PBKDF2 为 CPU 密集计算（hashlib 计算期间释放 GIL），放到专用线程池避免阻塞事件循环
+_PWD_POOL = ThreadPoolExecutor(max_workers=os.cpu_count() or 4, thread_name_prefix="pwd-hash")
+
+async def _hash_password_async(password: str) -> str:
+    return await asyncio.get_running_loop().run_in_executor(_PWD_POOL, _hash_password, password)
+
+async def _verify_password_async(password: str, password_hash: str) -> bool:
+    return await asyncio.get_running_loop().run_in_executor(_PWD_POOL, _verify_password, password, password_hash)
+
+# 邮箱格式校验（模块级预编译，各接口共用）
+_EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
 
 # 邮件配置（从环境变量读取）
 SMTP_HOST = os.getenv("SMTP_HOST", "smtp.qq.com")
@@ -28,8 +89,147 @@ SMTP_PASS = os.getenv("SMTP_PASS", "")
 SMTP_FROM_NAME = os.getenv("SMTP_FROM_NAME", "MCP Assistant")
 PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "http://localhost:5050")
 
+# JWT 解码结果缓存：同一 token 重复请求时跳过签名校验
+# key=(缓存代数, blake2b(token))，修改/重置密码时递增代数使全部条目失效
+TOKEN_CACHE_TTL_SECONDS = 300
+# 距过期不足该秒数的 token 不入缓存，保证过期判定及时生效
+TOKEN_CACHE_EXP_MARGIN_SECONDS = 60
+_token_cache = TTLCache(maxsize=10000, ttl=TOKEN_CACHE_TTL_SECONDS)
+_token_cache_generation = 0
+
+# 进程内限流（固定窗口）：在访问数据库前拦截突发请求；数据库侧的频率校验仍保留
+RATE_LIMIT_WINDOW_SECONDS = 60
+SEND_CODE_LIMIT_PER_WINDOW = 1
+LOGIN_WITH_CODE_LIMIT_PER_WINDOW = 5
+_rate_cache = TTLCache(maxsize=100_000, ttl=RATE_LIMIT_WINDOW_SECONDS)
+
+def _rate_limited(key: tuple, limit: int) -> bool:
+    """计数 +1；当前窗口内已达到 limit 次时返回 True（本次不计数）。"""
+    entry = _rate_cache.get(key)
+    if entry is None:
+        # 以可变列表保存计数，原地累加不会刷新过期时间
+        _rate_cache.set(key, [1])
+        return False
+    if entry[0] >= limit:
+        return True
+    entry[0] += 1
+    return False
+
+def _client_ip(request: Request) -> str:
+    return request.client.host if request.client else ""
+
 # 创建认证路由器
-auth_router = APIRouter(prefix="/api/auth", tags=["authentication"])
+auth_router = APIRouter(prefix="/api/auth", tags=["authentication"], default_response_class=FastJSONResponse)
+
+# 请求体模型：字段缺省为空串，空值/格式等业务校验仍在各接口内完成（保持原有错误提示）
+_LowerStr = Annotated[str, AfterValidator(str.lower)]
+
+class _AuthPayload(BaseModel):
+    # 所有字符串字段统一去除首尾空白
+    model_config = ConfigDict(str_strip_whitespace=True)
+
+class RegisterIn(_AuthPayload):
+    username: str = ""
+    email: _LowerStr = ""
+    password: str = ""
+    confirm_password: str = ""
+    code: str = ""
+
+class SendCodeIn(_AuthPayload):
+    email: _LowerStr = ""
+    purpose: str = "register"
+
+class ResetPasswordIn(_AuthPayload):
+    email: _LowerStr = ""
+    code: str = ""
+    new_password: str = ""
+    confirm_password: str = ""
+
+class LoginIn(_AuthPayload):
+    username: str = ""
+    password: str = ""
+
+class LoginWithCodeIn(_AuthPayload):
+    email: _LowerStr = ""
+    code: str = ""
+
+class ChangePasswordIn(_AuthPayload):
+    old_password: str = ""
+    new_password: str = ""
+
+class UpdateProfileIn(_AuthPayload):
+    username: str = ""
+    new_username: str = ""
+
+class UpdateEmailIn(_AuthPayload):
+    new_email: _LowerStr = ""
+    code: str = ""
+
+# HS256 校验快速路径：HMAC 的密钥填充（ipad/opad）只在启动时计算一次，
+# 每个 token 只需 copy() 后对 header.payload 做一次摘要
+_HS256_BASE = hmac.new(JWT_SECRET.encode("utf-8"), digestmod=hashlib.sha256)
+
+def _b64url_decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+def _b64url_encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+# 固定的 JWT 头部只编码一次
+_HS256_HEADER_B64 = _b64url_encode(json.dumps({"alg": JWT_ALG, "typ": "JWT"}, separators=(",", ":")).encode("utf-8"))
+
+def _sign_hs256(payload: Dict[str, Any]) -> str:
+    """签发 HS256 JWT（与 PyJWT 生成的 token 互相兼容）。"""
+    signing_input = f"{_HS256_HEADER_B64}.{_b64url_encode(json.dumps(payload, separators=(',', ':')).encode('utf-8'))}"
+    mac = _HS256_BASE.copy()
+    mac.update(signing_input.encode("ascii"))
+    return f"{signing_input}.{_b64url_encode(mac.digest())}"
+
+def _verify_hs256(token: str) -> Dict[str, Any]:
+    """校验 HS256 JWT 的签名与 exp/nbf，返回 payload；任何不符都抛 ValueError。"""
+    header_b64, payload_b64, sig_b64 = token.split(".")
+    header = json.loads(_b64url_decode(header_b64))
+    if not isinstance(header, dict) or header.get("alg") != JWT_ALG:
+        raise ValueError("unsupported alg")
+    mac = _HS256_BASE.copy()
+    mac.update(f"{header_b64}.{payload_b64}".encode("ascii"))
+    if not hmac.compare_digest(mac.digest(), _b64url_decode(sig_b64)):
+        raise ValueError("bad signature")
+    payload = json.loads(_b64url_decode(payload_b64))
+    if not isinstance(payload, dict):
+        raise ValueError("invalid payload")
+    now = time.time()
+    if payload.get("exp") is not None and float(payload["exp"]) <= now:
+        raise ValueError("token expired")
+    if payload.get("nbf") is not None and float(payload["nbf"]) > now:
+        raise ValueError("token not yet valid")
+    return payload
+
+def _invalidate_token_cache() -> None:
+    """递增缓存代数，之后的请求都会重新校验 JWT。"""
+    global _token_cache_generation
+    _token_cache_generation += 1
+    _token_cache.clear()
+
+def _decode_token(token: str) -> Dict[str, Any]:
+    """校验 JWT 并返回 {id, username}；校验失败抛异常。结果按 token 摘要缓存。"""
+    key = (_token_cache_generation, hashlib.blake2b(token.encode("utf-8"), digest_size=16).digest())
+    cached = _token_cache.get(key)
+    if cached is not None:
+        return dict(cached)
+    payload = _verify_hs256(token)
+    uid = payload.get("uid")
+    username = payload.get("usr")
+    if not uid or not username:
+        raise ValueError("invalid token")
+    user = {"id": uid, "username": username}
+    ttl = TOKEN_CACHE_TTL_SECONDS
+    exp = payload.get("exp")
+    if exp is not None:
+        ttl = min(ttl, float(exp) - time.time() - TOKEN_CACHE_EXP_MARGIN_SECONDS)
+    if ttl > 0:
+        _token_cache.set(key, user, ttl=ttl)
+    return dict(user)
 
 def _auth_user_from_request(request: Request) -> Dict[str, Any]:
     """从请求中验证用户身份并返回用户信息"""
@@ -38,46 +238,90 @@ def _auth_user_from_request(request: Request) -> Dict[str, Any]:
         raise HTTPException(status_code=401, detail="缺少认证信息")
     token = auth[7:].strip()
     try:
-        payload = pyjwt.decode(token, JWT_SECRET, algorithms=[JWT_ALG])
-        uid = payload.get("uid")
-        username = payload.get("usr")
-        if not uid or not username:
-            raise ValueError("invalid token")
-        return {"id": uid, "username": username}
+        return _decode_token(token)
     except Exception:
         raise HTTPException(status_code=401, detail="认证失败，请重新登录")
 
-def _send_email(to_email: str, subject: str, html: str) -> None:
-    """发送邮件的辅助函数"""
-    msg = MIMEText(html, 'html', 'utf-8')
-    msg['From'] = formataddr((SMTP_FROM_NAME, SMTP_USER))
-    msg['To'] = to_email
-    msg['Subject'] = subject
-    
+async def current_user(request: Request) -> Dict[str, Any]:
+    """FastAPI 依赖：返回当前登录用户，未登录/失效时返回 401。"""
+    return _auth_user_from_request(request)
+
+# 复用的 SMTP 长连接：省去每封邮件的 TCP/TLS 握手与 AUTH；服务端断开后自动重连
+SMTP_TIMEOUT_SECONDS = 30
+_smtp_server = None
+_smtp_lock = threading.Lock()
+# 这些异常说明连接已失效，重连后重试一次
+_SMTP_RECONNECT_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError, ssl.SSLError, TimeoutError)
+
+def _smtp_connect():
+    """建立并登录 SMTP 连接"""
     if SMTP_SECURE:
-        server = smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT)
+        server = smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT_SECONDS)
         try:
             server.ehlo()
         except Exception:
             pass
     else:
-        server = smtplib.SMTP(SMTP_HOST, SMTP_PORT)
+        server = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT_SECONDS)
         try:
             server.ehlo()
             server.starttls()
             server.ehlo()
         except Exception:
             pass
-    
     try:
         server.login(SMTP_USER, SMTP_PASS)
-        server.sendmail(SMTP_USER, [to_email], msg.as_string())
-    finally:
+    except Exception:
+        _smtp_close(server)
+        raise
+    return server
+
+def _smtp_close(server) -> None:
+    try:
+        server.quit()
+    except Exception:
         try:
-            server.quit()
+            server.close()
         except Exception:
             pass
 
+def _send_email(to_email: str, subject: str, html: str) -> None:
+    """发送邮件的辅助函数（同步阻塞，复用长连接，线程安全）"""
+    global _smtp_server
+    msg = MIMEText(html, 'html', 'utf-8')
+    msg['From'] = formataddr((SMTP_FROM_NAME, SMTP_USER))
+    msg['To'] = to_email
+    msg['Subject'] = subject
+    
+    with _smtp_lock:
+        for attempt in range(2):
+            if _smtp_server is None:
+                _smtp_server = _smtp_connect()
+            try:
+                _smtp_server.sendmail(SMTP_USER, [to_email], msg.as_string())
+                return
+            except _SMTP_RECONNECT_ERRORS:
+                # 空闲连接被服务端关闭：丢弃后重连重试一次
+                _smtp_close(_smtp_server)
+                _smtp_server = None
+                if attempt:
+                    raise
+
+# 后台发送任务的强引用，防止任务在完成前被回收
+_email_tasks = set()
+
+async def _send_email_async(to_email: str, subject: str, html: str) -> None:
+    """在线程池中发送邮件，失败只记录日志（调用方不等待结果）。"""
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, _send_email, to_email, subject, html)
+    except Exception as e:
+        print(f"❌ 发送邮件失败 ({to_email}): {e}")
+
+def _send_email_background(to_email: str, subject: str, html: str) -> None:
+    task = asyncio.create_task(_send_email_async(to_email, subject, html))
+    _email_tasks.add(task)
+    task.add_done_callback(_email_tasks.discard)
+
 # 依赖注入函数
 def get_chat_db():
     """获取 chat_db 实例的依赖注入函数，需要在主模块中设置"""
@@ -90,14 +334,14 @@ def get_chat_db():
 
 # 认证路由处理函数
 @auth_router.post("/register")
-async def register(payload: Dict[str, Any]):
+async def register(payload: RegisterIn):
     """用户注册接口"""
     chat_db = get_chat_db()
         
-    username = (payload or {}).get("username", "").strip()
-    email = (payload or {}).get("email", "").strip().lower()
-    password = (payload or {}).get("password", "").strip()
-    confirm_password = (payload or {}).get("confirm_password", "").strip()
+    username = payload.username
+    email = payload.email
+    password = payload.password
+    confirm_password = payload.confirm_password
     
     if not username or not email or not password or not confirm_password:
         raise HTTPException(status_code=400, detail="用户名、邮箱与密码不能为空")
@@ -105,7 +349,7 @@ async def register(payload: Dict[str, Any]):
         raise HTTPException(status_code=400, detail="两次输入的密码不一致")
     
     # 基础格式校验
-    if "@" not in email or "." not in email.split("@")[-1]:
+    if not _EMAIL_RE.match(email):
         raise HTTPException(status_code=400, detail="邮箱格式不正确")
     if len(password) < 8:
         raise HTTPException(status_code=400, detail="密码长度至少8位")
@@ -119,7 +363,7 @@ async def register(payload: Dict[str, Any]):
         raise HTTPException(status_code=400, detail="邮箱已被注册")
     
     # 邮箱验证码（必须）
-    code = (payload or {}).get("code", "").strip()
+    code = payload.code
     if not code:
         raise HTTPException(status_code=400, detail="请填写邮箱验证码")
     ok = await chat_db.verify_code(email=email, code=code, purpose="register")
@@ -127,57 +371,55 @@ async def register(payload: Dict[str, Any]):
         raise HTTPException(status_code=400, detail="邮箱验证码无效或已过期")
     
     # 哈希密码
-    password_hash = pwd_context.hash(password)
+    password_hash = await _hash_password_async(password)
     ok = await chat_db.create_user(username, email, password_hash)
     if not ok:
         raise HTTPException(status_code=500, detail="注册失败")
     return {"success": True}
 
 @auth_router.post("/send_code")
-async def send_code(payload: Dict[str, Any]):
+async def send_code(payload: SendCodeIn, request: Request):
     """发送邮箱验证码：purpose=register/reset_password"""
     chat_db = get_chat_db()
         
-    email = (payload or {}).get("email", "").strip().lower()
-    purpose = (payload or {}).get("purpose", "register").strip()
+    email = payload.email
+    purpose = payload.purpose
     
     if not email:
         raise HTTPException(status_code=400, detail="邮箱不能为空")
-    if "@" not in email:
+    if not _EMAIL_RE.match(email):
         raise HTTPException(status_code=400, detail="邮箱格式不正确")
     
     # 基础SMTP配置校验
     if not SMTP_USER or not SMTP_PASS:
         raise HTTPException(status_code=500, detail="邮件服务未配置(SMTP_USER/SMTP_PASS)，请先在 .env 设置并重启后端")
     
-    # 频率限制
+    # 频率限制：先查进程内计数，再查数据库
+    if _rate_limited(("send_code", _client_ip(request), email, purpose), SEND_CODE_LIMIT_PER_WINDOW):
+        raise HTTPException(status_code=429, detail="发送过于频繁，请稍后再试")
     can = await chat_db.can_send_code(email, purpose, min_interval_seconds=60)
     if not can:
         raise HTTPException(status_code=429, detail="发送过于频繁，请稍后再试")
     
-    # 生成6位验证码
-    import random
-    code = "".join([str(random.randint(0,9)) for _ in range(6)])
+    # 生成6位验证码（密码学安全随机数）
+    code = f"{secrets.randbelow(1_000_000):06d}"
     ok = await chat_db.create_verification_code(email, code, purpose, ttl_minutes=10)
     if not ok:
         raise HTTPException(status_code=500, detail="创建验证码失败")
     
-    # 发送邮件
-    try:
-        html = f"""
-        <div style='font-family:Arial,Helvetica,sans-serif;'>
-          <p>您的验证码为：<strong style='font-size:18px'>{code}</strong></p>
-          <p>10分钟内有效。用于 {purpose}。</p>
-          <p style='color:#718096'>如果不是您本人操作，请忽略此邮件。</p>
-        </div>
-        """
-        _send_email(email, "您的验证码", html)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"发送邮件失败: {e}")
+    # 发送邮件：验证码已入库，后台投递不阻塞响应；失败时用户可稍后重新获取
+    html = f"""
+    <div style='font-family:Arial,Helvetica,sans-serif;'>
+      <p>您的验证码为：<strong style='font-size:18px'>{code}</strong></p>
+      <p>10分钟内有效。用于 {purpose}。</p>
+      <p style='color:#718096'>如果不是您本人操作，请忽略此邮件。</p>
+    </div>
+    """
+    _send_email_background(email, "您的验证码", html)
     return {"success": True}
 
 @auth_router.post("/reset_password")
-async def reset_password(payload: Dict[str, Any]):
+async def reset_password(payload: ResetPasswordIn):
     """找回密码：通过邮箱验证码重置新密码。
 
     请求体：{ email: str, code: str, new_password: str, confirm_password?: str }
@@ -189,14 +431,14 @@ async def reset_password(payload: Dict[str, Any]):
     """
     chat_db = get_chat_db()
 
-    email = (payload or {}).get("email", "").strip().lower()
-    code = (payload or {}).get("code", "").strip()
-    new_password = (payload or {}).get("new_password", "").strip()
-    confirm_password = (payload or {}).get("confirm_password", "").strip()
+    email = payload.email
+    code = payload.code
+    new_password = payload.new_password
+    confirm_password = payload.confirm_password
 
     if not email or not code or not new_password:
         raise HTTPException(status_code=400, detail="缺少必要参数")
-    if "@" not in email:
+    if not _EMAIL_RE.match(email):
         raise HTTPException(status_code=400, detail="邮箱格式不正确")
     if confirm_password and new_password != confirm_password:
         raise HTTPException(status_code=400, detail="两次输入的密码不一致")
@@ -211,24 +453,26 @@ async def reset_password(payload: Dict[str, Any]):
     if not ok_code:
         raise HTTPException(status_code=400, detail="邮箱验证码无效或已过期")
 
+    new_hash = await _hash_password_async(new_password)
     try:
-        async with __import__('aiosqlite').connect(chat_db.db_path) as db:
+        async with get_writer() as db:
             await db.execute(
                 "UPDATE users SET password_hash = ? WHERE id = ?",
-                (pwd_context.hash(new_password), user["id"]) 
+                (new_hash, user["id"]) 
             )
             await db.commit()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"重置密码失败: {e}")
+    _invalidate_token_cache()
     return {"success": True}
 
 @auth_router.post("/login")
-async def login(payload: Dict[str, Any]):
+async def login(payload: LoginIn):
     """用户登录接口 - 支持用户名或邮箱+密码登录"""
     chat_db = get_chat_db()
         
-    username = (payload or {}).get("username", "").strip()
-    password = (payload or {}).get("password", "").strip()
+    username = payload.username
+    password = payload.password
     
     if not username or not password:
         raise HTTPException(status_code=400, detail="用户名/邮箱与密码不能为空")
@@ -244,14 +488,10 @@ async def login(payload: Dict[str, Any]):
     if not user:
         raise HTTPException(status_code=401, detail="用户名/邮箱或密码错误")
     
-    if not pwd_context.verify(password, user.get("password_hash") or ""):
+    if not await _verify_password_async(password, user.get("password_hash") or ""):
         raise HTTPException(status_code=401, detail="用户名/邮箱或密码错误")
     
-    token = pyjwt.encode(
-        {"uid": user["id"], "usr": user["username"], "iat": int(datetime.now().timestamp())}, 
-        JWT_SECRET, 
-        algorithm=JWT_ALG
-    )
+    token = _sign_hs256({"uid": user["id"], "usr": user["username"], "iat": int(time.time())})
     return {
         "success": True, 
         "token": token, 
@@ -259,19 +499,23 @@ async def login(payload: Dict[str, Any]):
     }
 
 @auth_router.post("/login_with_code")
-async def login_with_code(payload: Dict[str, Any]):
+async def login_with_code(payload: LoginWithCodeIn, request: Request):
     """邮箱验证码登录接口 - 无需密码"""
     chat_db = get_chat_db()
         
-    email = (payload or {}).get("email", "").strip().lower()
-    code = (payload or {}).get("code", "").strip()
+    email = payload.email
+    code = payload.code
     
     if not email or not code:
         raise HTTPException(status_code=400, detail="邮箱和验证码不能为空")
     
-    if "@" not in email:
+    if not _EMAIL_RE.match(email):
         raise HTTPException(status_code=400, detail="邮箱格式不正确")
     
+    # 限制单个 IP+邮箱 的尝试次数，防止暴力枚举验证码
+    if _rate_limited(("login_with_code", _client_ip(request), email), LOGIN_WITH_CODE_LIMIT_PER_WINDOW):
+        raise HTTPException(status_code=429, detail="尝试过于频繁，请稍后再试")
+    
     # 验证邮箱验证码
     ok = await chat_db.verify_code(email=email, code=code, purpose="login")
     if not ok:
@@ -283,11 +527,7 @@ async def login_with_code(payload: Dict[str, Any]):
         raise HTTPException(status_code=404, detail="该邮箱未注册")
     
     # 生成登录token
-    token = pyjwt.encode(
-        {"uid": user["id"], "usr": user["username"], "iat": int(datetime.now().timestamp())}, 
-        JWT_SECRET, 
-        algorithm=JWT_ALG
-    )
+    token = _sign_hs256({"uid": user["id"], "usr": user["username"], "iat": int(time.time())})
     return {
         "success": True, 
         "token": token, 
@@ -295,15 +535,12 @@ async def login_with_code(payload: Dict[str, Any]):
     }
 
 @auth_router.post("/change_password")
-async def change_password(request: Request, payload: Dict[str, Any]):
+async def change_password(payload: ChangePasswordIn, authed_user: Dict[str, Any] = Depends(current_user)):
     """用户修改密码：必须登录（Bearer），并提供旧密码与新密码。"""
     chat_db = get_chat_db()
 
-    # 从 Bearer Token 获取当前用户
-    authed_user = _auth_user_from_request(request)
-
-    old_password = (payload or {}).get("old_password", "").strip()
-    new_password = (payload or {}).get("new_password", "").strip()
+    old_password = payload.old_password
+    new_password = payload.new_password
 
     if not old_password or not new_password:
         raise HTTPException(status_code=400, detail="缺少必要参数")
@@ -315,28 +552,30 @@ async def change_password(request: Request, payload: Dict[str, Any]):
     if not user:
         raise HTTPException(status_code=404, detail="用户不存在")
 
-    if not pwd_context.verify(old_password, user.get("password_hash") or ""):
+    if not await _verify_password_async(old_password, user.get("password_hash") or ""):
         raise HTTPException(status_code=401, detail="旧密码不正确")
 
     # 更新为新密码
+    new_hash = await _hash_password_async(new_password)
     try:
-        async with __import__('aiosqlite').connect(chat_db.db_path) as db:
+        async with get_writer() as db:
             await db.execute(
                 "UPDATE users SET password_hash = ? WHERE id = ?",
-                (pwd_context.hash(new_password), user["id"]) 
+                (new_hash, user["id"]) 
             )
             await db.commit()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"更新密码失败: {e}")
+    _invalidate_token_cache()
     return {"success": True}
 
 @auth_router.post("/update_profile")
-async def update_profile(payload: Dict[str, Any]):
+async def update_profile(payload: UpdateProfileIn):
     """更新用户名。若新用户名已存在则报错。"""
     chat_db = get_chat_db()
         
-    username = (payload or {}).get("username", "").strip()
-    new_username = (payload or {}).get("new_username", "").strip()
+    username = payload.username
+    new_username = payload.new_username
     
     if not username or not new_username:
         raise HTTPException(status_code=400, detail="缺少必要参数")
@@ -351,7 +590,7 @@ async def update_profile(payload: Dict[str, Any]):
         raise HTTPException(status_code=404, detail="用户不存在")
     
     try:
-        async with __import__('aiosqlite').connect(chat_db.db_path) as db:
+        async with get_writer() as db:
             await db.execute(
                 "UPDATE users SET username = ? WHERE id = ?",
                 (new_username, user["id"]) 
@@ -362,7 +601,7 @@ async def update_profile(payload: Dict[str, Any]):
     return {"success": True}
 
 @auth_router.post("/update_email")
-async def update_email(request: Request, payload: Dict[str, Any]):
+async def update_email(payload: UpdateEmailIn, user: Dict[str, Any] = Depends(current_user)):
     """修改邮箱：需登录 + 邮箱验证码验证。
 
     请求体：{ new_email: str, code: str }
@@ -374,13 +613,12 @@ async def update_email(request: Request, payload: Dict[str, Any]):
     """
     chat_db = get_chat_db()
         
-    user = _auth_user_from_request(request)
-    new_email = (payload or {}).get("new_email", "").strip().lower()
-    code = (payload or {}).get("code", "").strip()
+    new_email = payload.new_email
+    code = payload.code
     
     if not new_email or not code:
         raise HTTPException(status_code=400, detail="缺少必要参数")
-    if "@" not in new_email:
+    if not _EMAIL_RE.match(new_email):
         raise HTTPException(status_code=400, detail="邮箱格式不正确")
     
     # 邮箱唯一性
@@ -394,7 +632,7 @@ async def update_email(request: Request, payload: Dict[str, Any]):
         raise HTTPException(status_code=400, detail="邮箱验证码无效或已过期")
     
     try:
-        async with __import__('aiosqlite').connect(chat_db.db_path) as db:
+        async with get_writer() as db:
             await db.execute(
                 "UPDATE users SET email = ? WHERE id = ?",
                 (new_email, user["id"])
@@ -405,12 +643,11 @@ async def update_email(request: Request, payload: Dict[str, Any]):
     return {"success": True}
 
 @auth_router.get("/credits")
-async def get_credits(request: Request):
+async def get_credits(user: Dict[str, Any] = Depends(current_user)):
     """查询当前登录用户的积分余额（通过Authorization Bearer校验）。"""
     chat_db = get_chat_db()
-    user = _auth_user_from_request(request)
     full = await chat_db.get_user_by_username(user["username"]) or {}
     return {"success": True, "credits": full.get("credits", 0)}
 
 # 导出认证相关的辅助函数，供其他模块使用
-__all__ = ["auth_router", "_auth_user_from_request", "_send_email"]
\ No newline at end of file
+__all__ = ["auth_router", "_auth_user_from_request", "current_user", "_send_email"]
\ No newline at end of file
@@ -0,0 +1,52 @@
+# db_pool.py
+"""
+SQLite 连接访问入口：
+- 连接统一由 ChatDatabase 持有：单个写连接（写锁串行化，SQLite 同一时刻只允许一个写事务）
+  与只读连接池（WAL 模式下可与写连接并发，读不到未提交的写事务）
+- 本模块只是转发，供不直接持有 ChatDatabase 的接口模块使用，进程内不会出现第二套写连接
+
+替代各接口中每次请求 aiosqlite.connect() 的写法，避免反复创建工作线程与预热页缓存。
+"""
+
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+import aiosqlite
+
+_database = None  # ChatDatabase 实例
+
+
+def init_pool(database) -> None:
+    """绑定 ChatDatabase 实例（应用启动、数据库初始化成功后调用一次）。"""
+    global _database
+    _database = database
+    print("🔌 数据库连接池已就绪（复用 ChatDatabase 的写连接与只读连接池）")
+
+
+def close_pool() -> None:
+    """解除绑定；连接本身随 ChatDatabase.close() 关闭。"""
+    global _database
+    _database = None
+
+
+def _require_database():
+    if _database is None:
+        raise RuntimeError("数据库连接池未初始化")
+    return _database
+
+
+@asynccontextmanager
+async def get_writer() -> AsyncIterator[aiosqlite.Connection]:
+    """独占写连接；调用方负责 commit，异常或遗留未提交事务时自动回滚，避免事务泄漏给下一个使用者。"""
+    async with _require_database().writer() as db:
+        yield db
+
+
+@asynccontextmanager
+async def acquire_reader() -> AsyncIterator[aiosqlite.Connection]:
+    """从只读连接池借出一个连接，用完归还。"""
+    async with _require_database().reader() as db:
+        yield db
+
+
+__all__ = ["init_pool", "close_pool", "get_writer", "acquire_reader"]
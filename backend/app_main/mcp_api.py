@@ -5,9 +5,10 @@ MCP 相关 API 模块 - 处理 MCP 工具、服务器配置等相关接口
 
 from fastapi import APIRouter, HTTPException, Body
 from typing import Dict, Any
+from app_main.responses import FastJSONResponse
 
-# 创建 MCP 路由器
-mcp_router = APIRouter(prefix="/api", tags=["mcp"])
+# 创建 MCP 路由器（工具列表/配置可能较大，统一使用 orjson 编码）
+mcp_router = APIRouter(prefix="/api", tags=["mcp"], default_response_class=FastJSONResponse)
 
 def get_mcp_agent():
     """获取 mcp_agent 实例的依赖注入函数，需要在主模块中设置"""
@@ -36,14 +37,11 @@ async def get_mcp_servers():
         mcp_agent = get_mcp_agent()
         cfg = mcp_agent.config.load_config() or {}
         servers = cfg.get("servers", {})
-        # 隐去 headers 的值，仅暴露 key
-        redacted = {}
-        for name, sc in servers.items():
-            sc_copy = dict(sc)
-            headers = dict(sc_copy.get("headers", {}) or {})
-            if headers:
-                sc_copy["headers"] = {k: "***" for k in headers.keys()}
-            redacted[name] = sc_copy
+        # 隐去 headers 的值，仅暴露 key；无 headers 的服务器配置原样返回
+        redacted = {
+            name: ({**sc, "headers": dict.fromkeys(sc["headers"], "***")} if sc.get("headers") else sc)
+            for name, sc in servers.items()
+        }
         return {"success": True, "data": redacted}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"读取MCP配置失败: {str(e)}")
@@ -1,18 +1,24 @@
 """
 量化意图检测模块：
-- 提供基于关键词的快速判断 _detect_quant_intent
 - 提供基于 Oversee 判别LLM（GLM-4.5-flash）的严格判断 is_quant_by_oversee
+- 调用LLM前先做关键词预筛：明显的量化需求直接判定为是，完全不相关的文本直接判定为否，
+  只有模糊的中间情况才请求判别LLM
 
 注意：判别LLM仅接收“本次用户文本”，不携带上下文
 """
 
 import os
+import re
+import hashlib
+import functools
 from typing import Optional
 
 from dotenv import load_dotenv, find_dotenv
 from langchain_openai import ChatOpenAI
 from langchain_core.messages import SystemMessage, HumanMessage
 
+from app_main.ttl_cache import TTLCache
+
 
 def _is_truthy(val: str) -> bool:
     try:
@@ -26,7 +32,57 @@ def detect_quant_intent_by_keywords(raw_text: str) -> bool:
     return False
 
 
+_DEFAULT_SYSTEM_PROMPT = (
+    "你是一个严格的路由判别器，只能回答‘是’或‘否’。\n"
+    "判定目标：用户是否在请求‘量化交易/回测/因子/策略代码’（尤其恒生 PTrader/HS PTrader 平台）。\n"
+    "满足任一条件即回答‘是’：\n"
+    "- 明确提及量化/回测/因子/择时/自动交易/交易机器人/买入/卖出/止损/止盈/仓位/信号\n"
+    "- 明确提及恒生/Ptrader/HS PTrader 或其API/生命周期函数（initialize/handle_data/run_daily/run_interval/on_order_response/on_trade_response/after_trading_end/set_universe/set_benchmark/set_commission/order/order_target）\n"
+    "- 模糊提及‘赚钱的代码/会赚钱的代码’且语境是股票/交易相关\n"
+    "以下情况回答‘否’：仅是一般性财经/行业/公司分析，没有要求生成量化策略代码或回测脚本。\n"
+)
+
+# 强特征词：命中 >= 2 个不同词即视为明确的量化需求（PTrader API/生命周期函数与量化术语）
+_STRONG_QUANT_TOKENS = (
+    "ptrader", "handle_data", "run_daily", "run_interval", "on_order_response", "on_trade_response",
+    "after_trading_end", "set_universe", "set_benchmark", "set_commission", "order_target",
+    "量化", "回测", "因子", "择时", "恒生", "止损", "止盈", "交易策略", "策略代码",
+)
+# 弱特征词：一个都未命中时，文本与量化/交易无关，无需调用判别LLM（含英文表述，避免英文需求被直接判否）
+_QUANT_HINT_TOKENS = _STRONG_QUANT_TOKENS + (
+    "initialize", "order", "策略", "交易", "股票", "买入", "卖出", "仓位", "信号", "自动", "赚钱", "机器人",
+    "backtest", "back-test", "quant", "strategy", "trading", "trade", "stop loss", "stop-loss", "take profit",
+    "position", "signal", "factor", "stock", "buy", "sell", "bot",
+)
+# 单个预编译正则完成一次线性扫描（长词优先，避免被其前缀抢先匹配）
+_STRONG_RE = re.compile("|".join(re.escape(t) for t in sorted(_STRONG_QUANT_TOKENS, key=len, reverse=True)), re.IGNORECASE)
+_HINT_RE = re.compile("|".join(re.escape(t) for t in sorted(_QUANT_HINT_TOKENS, key=len, reverse=True)), re.IGNORECASE)
+# 过短的文本（如“你好”“谢谢”）不做判别
+_MIN_TEXT_LENGTH = 4
+
+
+def _prefilter_quant(text: str) -> Optional[bool]:
+    """关键词预筛：True=明确是，False=明确否，None=交给判别LLM。"""
+    if len(text) < _MIN_TEXT_LENGTH or not _HINT_RE.search(text):
+        return False
+    hits = {m.group(0).lower() for m in _STRONG_RE.finditer(text)}
+    return True if len(hits) >= 2 else None
+
+
+# 判别LLM客户端单例：复用底层 httpx 连接池
+_oversee_client: Optional[ChatOpenAI] = None
+
+# 判别结果缓存：key=blake2b(归一化文本)，仅缓存明确的 True/False
+_classification_cache = TTLCache(maxsize=4096, ttl=24 * 3600)
+
+
+def _classification_key(raw_text: str) -> bytes:
+    return hashlib.blake2b(raw_text.strip().lower().encode("utf-8"), digest_size=16).digest()
+
+
+@functools.lru_cache(maxsize=1)
 def _get_oversee_config() -> dict:
+    """读取判别LLM配置（进程内只读取一次 .env；修改配置需重启服务）。"""
     try:
         # 尝试加载 .env（不覆盖系统变量）
         try:
@@ -46,10 +102,12 @@ def _get_oversee_config() -> dict:
             "model": model,
             "temperature": temperature,
             "timeout": timeout,
+            "system_prompt": os.getenv("OVERSEE_LLM_SYSTEM_PROMPT", "").strip() or _DEFAULT_SYSTEM_PROMPT,
+            "debug": _is_truthy(os.getenv("OVERSEE_LLM_DEBUG", "false")),
         }
         # DEBUG: 打印配置概览（不泄露完整Key）
         try:
-            if _is_truthy(os.getenv("OVERSEE_LLM_DEBUG", "false")):
+            if cfg["debug"]:
                 masked = "" if not cfg["api_key"] else ("***" + cfg["api_key"][-4:])
                 print(
                     f"🧭 Oversee配置: enabled={cfg['enabled']}, model={cfg['model']}, base_url={'set' if cfg['base_url'] else 'default'}, "
@@ -66,9 +124,26 @@ def _get_oversee_config() -> dict:
             "model": "",
             "temperature": 0.1,
             "timeout": 10,
+            "system_prompt": _DEFAULT_SYSTEM_PROMPT,
+            "debug": False,
         }
 
 
+def _get_client(cfg: dict) -> ChatOpenAI:
+    """懒加载判别LLM客户端；api_key/base_url 显式传入，不再改写 os.environ。"""
+    global _oversee_client
+    if _oversee_client is None:
+        _oversee_client = ChatOpenAI(
+            model=cfg["model"],
+            temperature=cfg["temperature"],
+            timeout=cfg["timeout"],
+            max_retries=1,
+            api_key=cfg["api_key"],
+            base_url=cfg.get("base_url") or None,
+        )
+    return _oversee_client
+
+
 async def is_quant_by_oversee(raw_text: str) -> Optional[bool]:
     """使用判别LLM判断是否量化需求。
     返回 True/False；若不可用或失败，返回 None（未知）。
@@ -80,53 +155,38 @@ async def is_quant_by_oversee(raw_text: str) -> Optional[bool]:
         if not cfg.get("enabled") or not cfg.get("api_key") or not cfg.get("model"):
             return None
 
-        prev_key = os.getenv("OPENAI_API_KEY")
-        prev_base = os.getenv("OPENAI_BASE_URL")
-        try:
-            os.environ["OPENAI_API_KEY"] = cfg["api_key"]
-            if cfg.get("base_url"):
-                os.environ["OPENAI_BASE_URL"] = cfg["base_url"]
-
-            clf = ChatOpenAI(
-                model=cfg["model"],
-                temperature=cfg["temperature"],
-                timeout=cfg["timeout"],
-                max_retries=1,
-            )
-            system_prompt = os.getenv("OVERSEE_LLM_SYSTEM_PROMPT", "").strip() or (
-                "你是一个严格的路由判别器，只能回答‘是’或‘否’。\n"
-                "判定目标：用户是否在请求‘量化交易/回测/因子/策略代码’（尤其恒生 PTrader/HS PTrader 平台）。\n"
-                "满足任一条件即回答‘是’：\n"
-                "- 明确提及量化/回测/因子/择时/自动交易/交易机器人/买入/卖出/止损/止盈/仓位/信号\n"
-                "- 明确提及恒生/Ptrader/HS PTrader 或其API/生命周期函数（initialize/handle_data/run_daily/run_interval/on_order_response/on_trade_response/after_trading_end/set_universe/set_benchmark/set_commission/order/order_target）\n"
-                "- 模糊提及‘赚钱的代码/会赚钱的代码’且语境是股票/交易相关\n"
-                "以下情况回答‘否’：仅是一般性财经/行业/公司分析，没有要求生成量化策略代码或回测脚本。\n"
-            )
-            msgs = [
-                SystemMessage(content=system_prompt),
-                HumanMessage(content=raw_text.strip()),
-            ]
-            resp = await clf.ainvoke(msgs)
-            content = (getattr(resp, "content", None) or "").strip()
-            normalized = content.lower()
-            decision: Optional[bool] = None
-            if normalized:
-                if normalized.startswith("是") or normalized in {"yes", "y", "true", "是"}:
-                    decision = True
-                elif normalized.startswith("否") or normalized in {"no", "n", "false", "否"}:
-                    decision = False
-            # 调试日志
-            try:
-                if _is_truthy(os.getenv("OVERSEE_LLM_DEBUG", "false")):
-                    print(f"🧪 Oversee判别LLM: raw='{content}' => decision={decision}")
-            except Exception:
-                pass
-            return decision
-        finally:
-            if prev_key is not None:
-                os.environ["OPENAI_API_KEY"] = prev_key
-            if prev_base is not None:
-                os.environ["OPENAI_BASE_URL"] = prev_base
+        text = raw_text.strip()
+        quick = _prefilter_quant(text)
+        if quick is not None:
+            if cfg["debug"]:
+                print(f"🧪 Oversee关键词预筛: decision={quick}")
+            return quick
+
+        key = _classification_key(raw_text)
+        cached = _classification_cache.get(key)
+        if cached is not None:
+            return cached
+
+        clf = _get_client(cfg)
+        msgs = [
+            SystemMessage(content=cfg["system_prompt"]),
+            HumanMessage(content=raw_text.strip()),
+        ]
+        resp = await clf.ainvoke(msgs)
+        content = (getattr(resp, "content", None) or "").strip()
+        normalized = content.lower()
+        decision: Optional[bool] = None
+        if normalized:
+            if normalized.startswith("是") or normalized in {"yes", "y", "true", "是"}:
+                decision = True
+            elif normalized.startswith("否") or normalized in {"no", "n", "false", "否"}:
+                decision = False
+        # 调试日志
+        if cfg["debug"]:
+            print(f"🧪 Oversee判别LLM: raw='{content}' => decision={decision}")
+        if decision is not None:
+            _classification_cache.set(key, decision)
+        return decision
     except Exception:
         return None
 
@@ -0,0 +1,16 @@
+# responses.py
+"""
+响应类选择：已安装 orjson 时使用 ORJSONResponse（C 实现，编码大记录列表更快），
+否则回退到 FastAPI 默认的 JSONResponse。
+"""
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+try:
+    import orjson  # noqa: F401
+except Exception:
+    orjson = None
+
+FastJSONResponse = ORJSONResponse if orjson is not None else JSONResponse
+
+__all__ = ["FastJSONResponse"]
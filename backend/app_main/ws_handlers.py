@@ -1,11 +1,12 @@
 import json
+from datetime import datetime
 from typing import Dict
 
 
 async def handle_ping(websocket, manager):
     await manager.send_personal_message({
         "type": "pong",
-        "timestamp": __import__('datetime').datetime.now().isoformat()
+        "timestamp": datetime.now().isoformat()
     }, websocket)
 
 
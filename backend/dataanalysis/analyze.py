@@ -7,35 +7,61 @@ import os
 import sys
 import sqlite3
 import json
+import heapq
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
+from functools import lru_cache
+from itertools import compress
 from pathlib import Path
-from collections import Counter
-import matplotlib.pyplot as plt
 import matplotlib
+matplotlib.use('Agg')  # 仅输出图片文件，跳过 GUI 后端初始化
+import matplotlib.pyplot as plt
+from matplotlib import font_manager
 import jieba
 from wordcloud import WordCloud
 import pandas as pd
 import numpy as np
 
+import generate_html_report
+
+try:
+    import orjson  # 可选：更快的 JSON 编码
+except Exception:
+    orjson = None
+
+try:
+    from numba import njit  # 可选：大语料时 JIT 编译分词过滤
+except Exception:
+    njit = None
+
 # 设置中文字体 - 稍后在下载字体后再配置
 # matplotlib.rcParams['font.sans-serif'] = ['SimHei', 'DejaVu Sans', 'Arial Unicode MS']
 # matplotlib.rcParams['axes.unicode_minus'] = False
 
+# 并行绘图的进程数（用户增长、聊天活跃度、工具统计、词云四个任务）
+PLOT_WORKERS = 4
+
+# 折线分块渲染，避免长序列单次绘制过慢
+matplotlib.rcParams['agg.path.chunksize'] = 10000
+
 # 项目路径
 BASE_DIR = Path(__file__).parent.parent
 DB_PATH = BASE_DIR / "chat_history.db"
+# 分析脚本自己的缓存库（提问词频物化表），与应用库分开，应用库只读打开
+ANALYSIS_DB_PATH = Path(__file__).parent / "analysis_cache.db"
 OUTPUT_DIR = Path(__file__).parent / "output"
 OUTPUT_DIR.mkdir(exist_ok=True)
 
 # 下载并设置中文字体（用于词云）
 FONT_PATH = Path(__file__).parent / "SimHei.ttf"
 
+@lru_cache(maxsize=1)
 def download_chinese_font():
-    """下载中文字体用于词云和图表"""
+    """下载中文字体用于词云和图表（结果缓存，一次运行内只配置一次）"""
     if FONT_PATH.exists():
         print(f"✓ 中文字体已存在: {FONT_PATH}")
         # 配置 matplotlib 使用下载的字体
-        from matplotlib import font_manager
         font_manager.fontManager.addfont(str(FONT_PATH))
         matplotlib.rcParams['font.sans-serif'] = ['Source Han Sans SC', 'SimHei', 'DejaVu Sans']
         matplotlib.rcParams['axes.unicode_minus'] = False
@@ -51,7 +77,6 @@ def download_chinese_font():
         urllib.request.urlretrieve(font_url, FONT_PATH)
         print(f"✓ 字体下载成功: {FONT_PATH}")
         # 配置 matplotlib 使用下载的字体
-        from matplotlib import font_manager
         font_manager.fontManager.addfont(str(FONT_PATH))
         matplotlib.rcParams['font.sans-serif'] = ['Source Han Sans SC', 'SimHei', 'DejaVu Sans']
         matplotlib.rcParams['axes.unicode_minus'] = False
@@ -69,7 +94,6 @@ def download_chinese_font():
             if os.path.exists(font):
                 print(f"✓ 使用系统字体: {font}")
                 # 配置 matplotlib 使用系统字体
-                from matplotlib import font_manager
                 font_manager.fontManager.addfont(font)
                 matplotlib.rcParams['font.sans-serif'] = ['WenQuanYi Zen Hei', 'SimHei', 'DejaVu Sans']
                 matplotlib.rcParams['axes.unicode_minus'] = False
@@ -80,106 +104,106 @@ def download_chinese_font():
         return None
 
 
+# 应用库连接打开后执行的 PRAGMA：只影响本连接的读取（不改日志模式等库级设置），分析场景下加大缓存
+_CONNECTION_PRAGMAS = (
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-131072",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA busy_timeout=5000",
+)
+
+
+def dump_json_bytes(data):
+    """将分析数据编码为带缩进的 UTF-8 JSON 字节（优先 orjson，不可用时回退标准库）"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+
+
+def atomic_write_bytes(path, payload):
+    """先写临时文件再替换，避免中途失败留下半截文件"""
+    path = Path(path)
+    tmp_path = path.with_name(path.name + '.tmp')
+    tmp_path.write_bytes(payload)
+    os.replace(tmp_path, path)
+
+
 def connect_db():
-    """连接数据库"""
+    """以只读方式连接应用数据库（分析脚本不修改线上库的结构与数据）"""
     if not DB_PATH.exists():
         print(f"❌ 数据库不存在: {DB_PATH}")
         sys.exit(1)
     
-    conn = sqlite3.connect(str(DB_PATH))
+    conn = sqlite3.connect(DB_PATH.resolve().as_uri() + "?mode=ro", uri=True)
     conn.row_factory = sqlite3.Row
+    for pragma in _CONNECTION_PRAGMAS:
+        conn.execute(pragma)
     return conn
 
 
 def get_user_statistics(conn):
-    """获取用户统计"""
+    """获取用户统计（一次扫描 users 表，条件聚合得到全部指标）"""
     cursor = conn.cursor()
     
-    stats = {}
-    
-    # 总用户数
-    cursor.execute("SELECT COUNT(*) as count FROM users")
-    stats['total_users'] = cursor.fetchone()['count']
-    
-    # 有邮箱的用户数
-    cursor.execute("SELECT COUNT(*) as count FROM users WHERE email IS NOT NULL AND email != ''")
-    stats['users_with_email'] = cursor.fetchone()['count']
-    
-    # 配置了 Tushare Token 的用户数
-    cursor.execute("SELECT COUNT(*) as count FROM users WHERE tushare_token IS NOT NULL AND tushare_token != ''")
-    stats['users_with_tushare'] = cursor.fetchone()['count']
-    
-    # 启用了 Tushare Token 的用户数
-    cursor.execute("SELECT COUNT(*) as count FROM users WHERE tushare_token_enabled = 1")
-    stats['users_tushare_enabled'] = cursor.fetchone()['count']
-    
-    # 积分统计
-    cursor.execute("SELECT AVG(credits) as avg, MIN(credits) as min, MAX(credits) as max FROM users")
-    row = cursor.fetchone()
-    stats['credits_avg'] = round(row['avg'] or 0, 2)
-    stats['credits_min'] = row['min'] or 0
-    stats['credits_max'] = row['max'] or 0
-    
-    # 注册时间分布（最近7天、30天）
-    cursor.execute("""
-        SELECT 
-            COUNT(*) as count,
-            datetime(created_at, 'localtime') as create_time
-        FROM users 
-        WHERE created_at >= datetime('now', '-7 days')
-    """)
-    stats['new_users_7days'] = len(cursor.fetchall())
-    
     cursor.execute("""
-        SELECT COUNT(*) as count
-        FROM users 
-        WHERE created_at >= datetime('now', '-30 days')
+        SELECT
+            COUNT(*) as total_users,
+            -- 有邮箱的用户数
+            SUM(CASE WHEN email IS NOT NULL AND email != '' THEN 1 ELSE 0 END) as users_with_email,
+            -- 配置了 / 启用了 Tushare Token 的用户数
+            SUM(CASE WHEN tushare_token IS NOT NULL AND tushare_token != '' THEN 1 ELSE 0 END) as users_with_tushare,
+            SUM(CASE WHEN tushare_token_enabled = 1 THEN 1 ELSE 0 END) as users_tushare_enabled,
+            -- 积分统计
+            AVG(credits) as credits_avg,
+            MIN(credits) as credits_min,
+            MAX(credits) as credits_max,
+            -- 注册时间分布（最近7天、30天）
+            SUM(CASE WHEN created_at >= datetime('now', '-7 days') THEN 1 ELSE 0 END) as new_users_7days,
+            SUM(CASE WHEN created_at >= datetime('now', '-30 days') THEN 1 ELSE 0 END) as new_users_30days
+        FROM users
     """)
-    stats['new_users_30days'] = cursor.fetchone()['count']
+    row = cursor.fetchone()
     
-    return stats
+    return {
+        'total_users': row['total_users'],
+        'users_with_email': row['users_with_email'] or 0,
+        'users_with_tushare': row['users_with_tushare'] or 0,
+        'users_tushare_enabled': row['users_tushare_enabled'] or 0,
+        'credits_avg': round(row['credits_avg'] or 0, 2),
+        'credits_min': row['credits_min'] or 0,
+        'credits_max': row['credits_max'] or 0,
+        'new_users_7days': row['new_users_7days'] or 0,
+        'new_users_30days': row['new_users_30days'] or 0,
+    }
 
 
 def get_chat_statistics(conn):
-    """获取聊天统计"""
+    """获取聊天统计（标量指标一次聚合扫描 + TOP 10 用户单独查询）"""
     cursor = conn.cursor()
     
-    stats = {}
-    
-    # 总会话数
-    cursor.execute("SELECT COUNT(DISTINCT session_id) as count FROM chat_records")
-    stats['total_sessions'] = cursor.fetchone()['count']
-    
-    # 总对话数
-    cursor.execute("SELECT COUNT(DISTINCT session_id || '-' || conversation_id) as count FROM chat_records")
-    stats['total_conversations'] = cursor.fetchone()['count']
-    
-    # 总消息数
-    cursor.execute("SELECT COUNT(*) as count FROM chat_records")
-    stats['total_messages'] = cursor.fetchone()['count']
-    
-    # 最近7天、30天的消息数
-    cursor.execute("""
-        SELECT COUNT(*) as count
-        FROM chat_records 
-        WHERE created_at >= datetime('now', '-7 days')
-    """)
-    stats['messages_7days'] = cursor.fetchone()['count']
-    
-    cursor.execute("""
-        SELECT COUNT(*) as count
-        FROM chat_records 
-        WHERE created_at >= datetime('now', '-30 days')
-    """)
-    stats['messages_30days'] = cursor.fetchone()['count']
-    
-    # 平均每个用户的消息数
     cursor.execute("""
-        SELECT COUNT(*) * 1.0 / COUNT(DISTINCT username) as avg
+        SELECT
+            -- 总会话数 / 总对话数 / 总消息数
+            COUNT(DISTINCT session_id) as total_sessions,
+            COUNT(DISTINCT session_id || '-' || conversation_id) as total_conversations,
+            COUNT(*) as total_messages,
+            -- 最近7天、30天的消息数
+            SUM(CASE WHEN created_at >= datetime('now', '-7 days') THEN 1 ELSE 0 END) as messages_7days,
+            SUM(CASE WHEN created_at >= datetime('now', '-30 days') THEN 1 ELSE 0 END) as messages_30days,
+            -- 平均每个用户的消息数（仅统计有用户名的消息）
+            SUM(CASE WHEN username IS NOT NULL THEN 1 ELSE 0 END) * 1.0 / NULLIF(COUNT(DISTINCT username), 0) as avg_messages_per_user
         FROM chat_records
-        WHERE username IS NOT NULL
     """)
-    stats['avg_messages_per_user'] = round(cursor.fetchone()['avg'] or 0, 2)
+    row = cursor.fetchone()
+    
+    stats = {
+        'total_sessions': row['total_sessions'],
+        'total_conversations': row['total_conversations'],
+        'total_messages': row['total_messages'],
+        'messages_7days': row['messages_7days'] or 0,
+        'messages_30days': row['messages_30days'] or 0,
+        'avg_messages_per_user': round(row['avg_messages_per_user'] or 0, 2),
+    }
     
     # 最活跃的用户 TOP 10
     cursor.execute("""
@@ -195,125 +219,314 @@ def get_chat_statistics(conn):
     return stats
 
 
-def get_tool_statistics(conn):
-    """获取工具调用统计"""
+def get_tool_statistics(conn, limit=20):
+    """获取工具调用统计（在 SQLite 内用 JSON1 的 json_each 展开并聚合，TOP 20）"""
     cursor = conn.cursor()
     
+    # 非法 JSON / 非数组 / 数组中的非对象元素均跳过，与逐行解析时的容错一致
+    try:
+        cursor.execute("""
+            SELECT COALESCE(json_extract(je.value, '$.name'), 'unknown') as name, COUNT(*) as count
+            FROM chat_records, json_each(chat_records.mcp_tools_called) as je
+            WHERE mcp_tools_called IS NOT NULL AND mcp_tools_called != '[]'
+              AND json_valid(mcp_tools_called) AND json_type(mcp_tools_called) = 'array'
+              AND je.type = 'object'
+            GROUP BY name
+            ORDER BY count DESC, name
+            LIMIT ?
+        """, (limit,))
+    except sqlite3.OperationalError as e:
+        # SQLite 未编译 JSON1 时退回 Python 逐行解析
+        print(f"⚠️ JSON1 不可用，改为逐行解析工具调用: {e}")
+        return _count_tools_in_python(conn, limit)
+    
+    return {row['name']: row['count'] for row in cursor.fetchall()}
+
+
+def _count_tools_in_python(conn, limit=20):
+    """逐行解析 mcp_tools_called 统计工具调用（defaultdict 计数 + heapq 取 TOP N）"""
+    cursor = conn.cursor()
     cursor.execute("""
         SELECT mcp_tools_called
         FROM chat_records
         WHERE mcp_tools_called IS NOT NULL AND mcp_tools_called != '[]'
     """)
     
-    tool_counter = Counter()
-    
-    for row in cursor.fetchall():
+    counts = defaultdict(int)
+    loads = orjson.loads if orjson is not None else json.loads
+    for (raw,) in cursor:
         try:
-            tools = json.loads(row['mcp_tools_called'])
-            for tool in tools:
-                if isinstance(tool, dict):
-                    tool_name = tool.get('name', 'unknown')
-                    tool_counter[tool_name] += 1
-        except:
-            pass
-    
-    return dict(tool_counter.most_common(20))
+            tools = loads(raw)
+        except (TypeError, ValueError):
+            continue
+        if not isinstance(tools, list):
+            continue
+        for tool in tools:
+            if isinstance(tool, dict):
+                name = tool.get('name')
+                counts['unknown' if name is None else name] += 1
+    
+    # 与 SQL 分支一致：按次数降序，次数相同按名称升序
+    top = heapq.nsmallest(limit, counts.items(), key=lambda item: (-item[1], str(item[0])))
+    return dict(top)
 
 
 def get_user_questions(conn):
-    """获取所有用户提问"""
+    """逐行产出用户提问（生成器，避免一次性载入全部提问）"""
     cursor = conn.cursor()
     
     cursor.execute("""
         SELECT user_input
         FROM chat_records
         WHERE user_input IS NOT NULL AND user_input != ''
-        ORDER BY created_at DESC
     """)
     
-    questions = [row['user_input'] for row in cursor.fetchall()]
-    return questions
+    for row in cursor:
+        yield row['user_input']
 
 
-def generate_wordcloud(text, output_path, title="词云"):
-    """生成词云"""
-    if not text or not text.strip():
-        print(f"⚠️ 文本为空，跳过词云生成: {title}")
-        return
-    
-    # 下载中文字体
-    font_path = download_chinese_font()
-    
-    # 使用结巴分词
-    words = jieba.cut(text)
-    filtered_words = []
-    
-    # 停用词
-    stop_words = set([
-        '的', '了', '是', '我', '你', '在', '有', '和', '就', '不', '人',
-        '都', '一', '一个', '上', '也', '很', '到', '说', '要', '去', '吗',
-        '会', '能', '没', '看', '好', '自己', '这', '那', '什么', '为',
-        '着', '下', '他', '她', '它', '们', '这个', '那个', '怎么', '可以',
-        '吧', '啊', '呢', '哦', '嗯', '哈', '嘿', '呀', '吧', '么', '吗'
-    ])
+# 词云停用词（模块级常量，避免每次生成词云时重建）
+STOP_WORDS: frozenset = frozenset([
+    '的', '了', '是', '我', '你', '在', '有', '和', '就', '不', '人',
+    '都', '一', '一个', '上', '也', '很', '到', '说', '要', '去', '吗',
+    '会', '能', '没', '看', '好', '自己', '这', '那', '什么', '为',
+    '着', '下', '他', '她', '它', '们', '这个', '那个', '怎么', '可以',
+    '吧', '啊', '呢', '哦', '嗯', '哈', '嘿', '呀', '吧', '么', '吗'
+])
+
+
+def init_jieba():
+    """预加载结巴词典（只加载一次）"""
+    if not jieba.dt.initialized:
+        jieba.initialize()
+
+
+# 一批分词结果达到该数量时才走 numba 过滤（小批量时 JIT 调度开销不划算）
+NUMBA_FILTER_MIN_TOKENS = 100_000
+
+
+def _keep_token_mask(ids, lens, blank, stop_ids):
+    """过滤掩码：长度 > 1、非空白、哈希不在已排序的停用词哈希数组中（二分查找）"""
+    out = np.empty(ids.size, dtype=np.bool_)
+    n = stop_ids.size
+    for i in range(ids.size):
+        if lens[i] <= 1 or blank[i]:
+            out[i] = False
+            continue
+        h = ids[i]
+        lo = 0
+        hi = n
+        while lo < hi:
+            mid = (lo + hi) >> 1
+            if stop_ids[mid] < h:
+                lo = mid + 1
+            else:
+                hi = mid
+        out[i] = not (lo < n and stop_ids[lo] == h)
+    return out
+
+
+_keep_token_mask_jit = njit(cache=True)(_keep_token_mask) if njit is not None else None
+
+
+def _filter_tokens_jit(tokens, stop_ids):
+    """用 numba 内核批量过滤分词结果；长度/哈希/空白判断均通过 map 在 C 层完成"""
+    count = len(tokens)
+    ids = np.fromiter(map(hash, tokens), dtype=np.int64, count=count)
+    lens = np.fromiter(map(len, tokens), dtype=np.int64, count=count)
+    blank = np.fromiter(map(str.isspace, tokens), dtype=np.bool_, count=count)
+    return compress(tokens, _keep_token_mask_jit(ids, lens, blank, stop_ids))
+
+
+def count_question_words(texts):
+    """逐段分词并累计词频（texts 为文本片段的可迭代对象），过滤单字、空白与停用词"""
+    freq = Counter()
+    cut = jieba.cut
+    stop_words = STOP_WORDS
+    
+    if _keep_token_mask_jit is None:
+        for chunk in texts:
+            # 先做最便宜的长度判断（大部分单字在此被过滤）；len > 1 时 isspace() 与 strip() 判空等价且不分配新字符串
+            freq.update(
+                word for word in cut(chunk)
+                if len(word) > 1 and not word.isspace() and word not in stop_words
+            )
+        return freq
+    
+    # 已安装 numba：分词结果攒批，够大时交给 JIT 内核过滤
+    # 字符串哈希按进程随机化，停用词哈希需在本进程内计算
+    stop_ids = np.sort(np.fromiter(map(hash, stop_words), dtype=np.int64, count=len(stop_words)))
+    buffer = []
+    for chunk in texts:
+        buffer.extend(cut(chunk))
+        if len(buffer) >= NUMBA_FILTER_MIN_TOKENS:
+            freq.update(_filter_tokens_jit(buffer, stop_ids))
+            buffer = []
+    freq.update(
+        word for word in buffer
+        if len(word) > 1 and not word.isspace() and word not in stop_words
+    )
+    return freq
+
+
+# 提问词频物化表（位于分析缓存库）：只对上次之后新增的提问分词，每次运行增量累加
+_TOKEN_TABLES = (
+    """
+    CREATE TABLE IF NOT EXISTS user_input_tokens (
+        word TEXT PRIMARY KEY,
+        cnt INTEGER NOT NULL
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS user_input_tokens_state (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        last_record_id INTEGER NOT NULL,
+        record_count INTEGER NOT NULL
+    )
+    """,
+)
+
+
+def connect_analysis_db():
+    """连接分析缓存库（不存在时创建），存放提问词频物化表"""
+    conn = sqlite3.connect(str(ANALYSIS_DB_PATH))
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    for ddl in _TOKEN_TABLES:
+        conn.execute(ddl)
+    conn.commit()
+    return conn
+
+
+def refresh_question_word_counts(conn, cache_conn):
+    """从应用库读取新增提问，把分词结果累加进缓存库的 user_input_tokens；记录被删除过时整表重建"""
+    cursor = conn.cursor()
     
-    for word in words:
-        if len(word) > 1 and word not in stop_words and word.strip():
-            filtered_words.append(word)
+    state = cache_conn.execute(
+        "SELECT last_record_id, record_count FROM user_input_tokens_state WHERE id = 1"
+    ).fetchone()
+    last_id, record_count = (state['last_record_id'], state['record_count']) if state else (0, 0)
     
-    text_for_cloud = ' '.join(filtered_words)
+    # 已处理范围内的提问数变了（清空过历史），旧词频不再可信
+    cursor.execute("""
+        SELECT COUNT(*) FROM chat_records
+        WHERE id <= ? AND user_input IS NOT NULL AND user_input != ''
+    """, (last_id,))
+    if cursor.fetchone()[0] != record_count:
+        print("♻️ 聊天记录有删除，重建提问词频表...")
+        cache_conn.execute("DELETE FROM user_input_tokens")
+        last_id, record_count = 0, 0
     
-    if not text_for_cloud.strip():
+    cursor.execute("""
+        SELECT id, user_input
+        FROM chat_records
+        WHERE id > ? AND user_input IS NOT NULL AND user_input != ''
+        ORDER BY id
+    """, (last_id,))
+    
+    new_rows = 0
+    
+    def iter_new_questions():
+        nonlocal last_id, new_rows
+        for row in cursor:
+            last_id = row['id']
+            new_rows += 1
+            yield row['user_input']
+    
+    freq = count_question_words(iter_new_questions())
+    
+    cache_conn.executemany("""
+        INSERT INTO user_input_tokens (word, cnt) VALUES (?, ?)
+        ON CONFLICT(word) DO UPDATE SET cnt = cnt + excluded.cnt
+    """, freq.items())
+    cache_conn.execute("""
+        INSERT OR REPLACE INTO user_input_tokens_state (id, last_record_id, record_count)
+        VALUES (1, ?, ?)
+    """, (last_id, record_count + new_rows))
+    cache_conn.commit()
+    
+    print(f"✓ 提问词频已更新: 新增提问 {new_rows} 条")
+
+
+def get_question_word_freq(conn, limit=200):
+    """获取提问词频 TOP N（优先读缓存库中的物化表，缓存库不可用时退回全量分词）"""
+    cache_conn = None
+    try:
+        cache_conn = connect_analysis_db()
+        refresh_question_word_counts(conn, cache_conn)
+        cursor = cache_conn.execute("""
+            SELECT word, cnt FROM user_input_tokens
+            ORDER BY cnt DESC
+            LIMIT ?
+        """, (limit,))
+        return {row['word']: row['cnt'] for row in cursor.fetchall()}
+    except sqlite3.Error as e:
+        print(f"⚠️ 提问词频表不可用，改为全量分词: {e}")
+        return dict(count_question_words(get_user_questions(conn)).most_common(limit))
+    finally:
+        if cache_conn is not None:
+            cache_conn.close()
+
+
+def generate_wordcloud(freq, output_path, title="词云"):
+    """根据词频生成词云"""
+    if not freq:
         print(f"⚠️ 分词后文本为空，跳过词云生成: {title}")
         return
     
-    # 生成词云
+    # 下载中文字体
+    font_path = download_chinese_font()
+    
+    # 生成词云（直接由 PIL 写出 PNG，不经过 matplotlib；标题由 HTML 报告的小节标题承担）
     try:
         wordcloud = WordCloud(
-            width=1600,
-            height=800,
+            width=800,
+            height=400,
             background_color='white',
             font_path=font_path,
             max_words=200,
+            prefer_horizontal=1.0,
             relative_scaling=0.5,
             colormap='viridis'
-        ).generate(text_for_cloud)
+        ).generate_from_frequencies(freq)
         
-        plt.figure(figsize=(16, 8))
-        plt.imshow(wordcloud, interpolation='bilinear')
-        plt.title(title, fontsize=20, pad=20)
-        plt.axis('off')
-        plt.tight_layout(pad=0)
-        plt.savefig(output_path, dpi=300, bbox_inches='tight')
-        plt.close()
+        wordcloud.to_file(output_path)
         
         print(f"✓ 词云已生成: {output_path}")
     except Exception as e:
         print(f"❌ 词云生成失败: {e}")
 
 
-def plot_user_growth(conn):
+def _daily_counts(timestamps):
+    """把时间戳序列按天分桶计数（在 pandas/NumPy 中截断日期，SQLite 只需扫描 created_at 索引）"""
+    days = pd.to_datetime(timestamps, errors='coerce', format='ISO8601').dropna().dt.floor('D')
+    daily = days.value_counts().sort_index()
+    # 日期转回字符串，作为分类横轴
+    return pd.DataFrame({
+        'date': daily.index.strftime('%Y-%m-%d'),
+        'count': daily.to_numpy(),
+    })
+
+
+def get_user_growth_data(conn):
+    """获取每日新增用户数"""
+    df = pd.read_sql_query("SELECT created_at FROM users WHERE created_at IS NOT NULL", conn)
+    return _daily_counts(df['created_at'])
+
+
+def plot_user_growth(df, output_dir):
     """绘制用户增长趋势"""
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        SELECT DATE(created_at) as date, COUNT(*) as count
-        FROM users
-        GROUP BY DATE(created_at)
-        ORDER BY date
-    """)
-    
-    data = cursor.fetchall()
-    
-    if not data:
+    if df.empty:
         print("⚠️ 没有用户数据")
         return
     
-    dates = [row['date'] for row in data]
-    counts = [row['count'] for row in data]
-    cumulative = np.cumsum(counts)
+    # 日期保持字符串，作为分类横轴（与下方 fill_between 的序号横轴对齐）
+    dates = df['date'].to_numpy()
+    counts = df['count'].to_numpy()
+    cumulative = counts.cumsum()
     
-    fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(12, 10))
+    fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(12, 10), constrained_layout=True)
     
     # 每日新增
     ax1.bar(dates, counts, color='skyblue', alpha=0.7)
@@ -332,54 +545,47 @@ def plot_user_growth(conn):
     ax2.grid(True, alpha=0.3)
     plt.setp(ax2.xaxis.get_majorticklabels(), rotation=45, ha='right')
     
-    plt.tight_layout()
-    output_path = OUTPUT_DIR / 'user_growth.png'
-    plt.savefig(output_path, dpi=300, bbox_inches='tight')
+    output_path = Path(output_dir) / 'user_growth.png'
+    plt.savefig(output_path, dpi=150)
     plt.close()
     
     print(f"✓ 用户增长图已生成: {output_path}")
 
 
-def plot_chat_activity(conn):
+def get_chat_activity_data(conn):
+    """获取最近30天的每日消息数（按时间正序，时间范围条件可走 created_at 索引）"""
+    df = pd.read_sql_query("""
+        SELECT created_at FROM chat_records
+        WHERE created_at >= DATE('now', '-29 days')
+    """, conn)
+    return _daily_counts(df['created_at'])
+
+
+def plot_chat_activity(df, output_dir):
     """绘制聊天活跃度"""
-    cursor = conn.cursor()
-    
-    # 按日期统计消息数
-    cursor.execute("""
-        SELECT DATE(created_at) as date, COUNT(*) as count
-        FROM chat_records
-        GROUP BY DATE(created_at)
-        ORDER BY date DESC
-        LIMIT 30
-    """)
-    
-    data = cursor.fetchall()
-    
-    if not data:
+    if df.empty:
         print("⚠️ 没有聊天数据")
         return
     
-    data = list(reversed(data))  # 按时间正序
-    dates = [row['date'] for row in data]
-    counts = [row['count'] for row in data]
+    dates = df['date'].to_numpy()
+    counts = df['count'].to_numpy()
     
-    plt.figure(figsize=(14, 6))
+    plt.figure(figsize=(14, 6), constrained_layout=True)
     plt.bar(dates, counts, color='mediumseagreen', alpha=0.7)
     plt.title('最近30天聊天活跃度', fontsize=14, pad=10)
     plt.xlabel('日期')
     plt.ylabel('消息数')
     plt.xticks(rotation=45, ha='right')
     plt.grid(True, alpha=0.3, axis='y')
-    plt.tight_layout()
     
-    output_path = OUTPUT_DIR / 'chat_activity.png'
-    plt.savefig(output_path, dpi=300, bbox_inches='tight')
+    output_path = Path(output_dir) / 'chat_activity.png'
+    plt.savefig(output_path, dpi=150)
     plt.close()
     
     print(f"✓ 聊天活跃度图已生成: {output_path}")
 
 
-def plot_tool_usage(tool_stats):
+def plot_tool_usage(tool_stats, output_dir):
     """绘制工具使用统计"""
     if not tool_stats:
         print("⚠️ 没有工具调用数据")
@@ -388,7 +594,7 @@ def plot_tool_usage(tool_stats):
     tools = list(tool_stats.keys())[:15]  # 取前15个
     counts = [tool_stats[t] for t in tools]
     
-    plt.figure(figsize=(12, 8))
+    plt.figure(figsize=(12, 8), constrained_layout=True)
     bars = plt.barh(tools, counts, color='steelblue', alpha=0.7)
     
     # 添加数值标签
@@ -400,15 +606,19 @@ def plot_tool_usage(tool_stats):
     plt.ylabel('工具名称')
     plt.gca().invert_yaxis()
     plt.grid(True, alpha=0.3, axis='x')
-    plt.tight_layout()
     
-    output_path = OUTPUT_DIR / 'tool_usage.png'
-    plt.savefig(output_path, dpi=300, bbox_inches='tight')
+    output_path = Path(output_dir) / 'tool_usage.png'
+    plt.savefig(output_path, dpi=150)
     plt.close()
     
     print(f"✓ 工具使用统计图已生成: {output_path}")
 
 
+def _init_plot_worker():
+    """绘图子进程初始化：配置中文字体（spawn 启动方式下子进程不会继承父进程的 rcParams）"""
+    download_chinese_font()
+
+
 def generate_report(user_stats, chat_stats, tool_stats):
     """生成文本报告"""
     report = []
@@ -476,6 +686,10 @@ def main():
     print("🔤 配置中文字体...")
     download_chinese_font()
     
+    # 预加载结巴词典
+    print("📚 加载分词词典...")
+    init_jieba()
+    
     # 连接数据库
     conn = connect_db()
     
@@ -492,24 +706,33 @@ def main():
         print("🔧 分析工具使用...")
         tool_stats = get_tool_statistics(conn)
         
-        # 4. 获取用户问题
-        print("❓ 提取用户提问...")
-        questions = get_user_questions(conn)
-        all_questions_text = '\n'.join(questions)
-        
-        # 5. 生成词云（确保字体已配置）
-        print("☁️ 生成词云...")
-        generate_wordcloud(
-            all_questions_text,
-            OUTPUT_DIR / 'questions_wordcloud.png',
-            '用户提问词云'
-        )
-        
-        # 6. 绘制图表
+        # 4. 获取绘图数据（在主进程查询，子进程只负责渲染）
         print("📊 绘制统计图表...")
-        plot_user_growth(conn)
-        plot_chat_activity(conn)
-        plot_tool_usage(tool_stats)
+        growth_df = get_user_growth_data(conn)
+        activity_df = get_chat_activity_data(conn)
+        
+        # 5. 四个图表互相独立，交给进程池并行渲染
+        with ProcessPoolExecutor(max_workers=PLOT_WORKERS, initializer=_init_plot_worker) as executor:
+            futures = [
+                executor.submit(plot_user_growth, growth_df, OUTPUT_DIR),
+                executor.submit(plot_chat_activity, activity_df, OUTPUT_DIR),
+                executor.submit(plot_tool_usage, tool_stats, OUTPUT_DIR),
+            ]
+            
+            # 6. 主进程增量分词新提问并读取词频，同时子进程在绘图
+            print("❓ 统计用户提问词频...")
+            freq = get_question_word_freq(conn)
+            
+            print("☁️ 生成词云...")
+            futures.append(executor.submit(
+                generate_wordcloud,
+                freq,
+                OUTPUT_DIR / 'questions_wordcloud.png',
+                '用户提问词云'
+            ))
+            
+            for future in futures:
+                future.result()
         
         # 7. 生成报告
         print("📝 生成分析报告...")
@@ -525,11 +748,16 @@ def main():
         }
         
         json_path = OUTPUT_DIR / 'analysis_data.json'
-        with open(json_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        atomic_write_bytes(json_path, dump_json_bytes(data))
         
         print(f"✓ 原始数据已保存: {json_path}")
         
+        # 9. 生成 HTML 报告（同一进程内直接使用统计结果）
+        print("🌐 生成 HTML 报告...")
+        html = generate_html_report.generate_html(**data)
+        html_path = generate_html_report.write_html(html, OUTPUT_DIR / 'analysis_report.html')
+        print(f"✓ HTML 报告已生成: {html_path}")
+        
         print("\n" + "=" * 60)
         print("✅ 数据分析完成！")
         print(f"📁 所有结果已保存到: {OUTPUT_DIR}")
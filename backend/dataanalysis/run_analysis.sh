@@ -11,15 +11,11 @@ cd "$(dirname "$0")"
 # 激活虚拟环境
 source ../../venv/bin/activate
 
-# 运行分析
+# 运行分析（HTML 报告在同一进程内生成）
 echo "🚀 开始数据分析..."
 python analyze.py
 
 if [ $? -eq 0 ]; then
-    echo ""
-    echo "📝 生成 HTML 报告..."
-    python generate_html_report.py
-    
     echo ""
     echo "📦 打包分析结果..."
     ./package_results.sh
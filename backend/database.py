@@ -7,11 +7,273 @@ SQLite数据库管理
 import os
 import json
 import uuid
+import asyncio
+import sqlite3
+import threading
+import zlib
 import aiosqlite
-from typing import List, Dict, Any, Optional
-from datetime import datetime, timedelta
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, List, Dict, Any, Optional, Sequence, Tuple, Union
 from pathlib import Path
 
+try:
+    import orjson  # 可选：更快的 JSON 编码
+except Exception:
+    orjson = None
+
+
+def _dumps_bytes(obj: Any) -> bytes:
+    """将对象编码为紧凑的 UTF-8 JSON 字节（优先 orjson，不可用或失败时回退标准库）。"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except Exception:
+            pass
+    return json.dumps(obj, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def _dumps_text(obj: Any) -> str:
+    """将对象编码为 JSON 文本用于写入 TEXT 列（优先 orjson 直接输出 UTF-8，失败时回退标准库 ensure_ascii=False）。"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj).decode("utf-8")
+        except Exception:
+            pass
+    return json.dumps(obj, ensure_ascii=False)
+
+
+def _share_keys(share_id: str) -> Optional[Tuple[bytes, str]]:
+    """对外的 share_id 为 32 位十六进制，库内新快照以 16 字节 BLOB 存储；旧快照仍是十六进制文本。
+
+    返回查询用的 (BLOB 键, 文本键)，格式不合法时返回 None（不可能存在对应快照）。
+    """
+    try:
+        return uuid.UUID(hex=share_id).bytes, share_id
+    except (ValueError, TypeError, AttributeError):
+        return None
+
+
+def _snapshot_payload(data: bytes, share_id: str) -> bytes:
+    """用已编码的记录数组拼出分享快照的完整响应体，记录只编码一次。"""
+    return b'{"success":true,"data":' + data + b',' + _dumps_bytes({"share_id": share_id, "readonly": True})[1:]
+
+
+# 压缩 BLOB 的首字节标识编码方式，便于日后更换算法；未压缩的旧数据以 JSON 的 '[' / '{' 开头，不会与之混淆
+# 只使用标准库 zlib：任何部署环境都能解压，不依赖可选包
+_BLOB_CODEC_ZLIB = 0x02
+
+
+def _compress_blob(raw: bytes) -> bytes:
+    """zlib 压缩字节串并加上编码标识。"""
+    return bytes((_BLOB_CODEC_ZLIB,)) + zlib.compress(raw, 6)
+
+
+def _decompress_blob(value: Any) -> Any:
+    """还原 _compress_blob 的结果；未压缩的旧值（文本或原始 JSON 字节）原样返回。"""
+    if not isinstance(value, (bytes, bytearray, memoryview)) or not value:
+        return value
+    value = bytes(value)
+    if value[0] == _BLOB_CODEC_ZLIB:
+        return zlib.decompress(value[1:])
+    return value
+
+
+def _encode_snapshot(records_json: Union[str, bytes], share_id: str) -> Tuple[bytes, bytes]:
+    """由 SQLite 拼装好的记录数组 JSON 生成压缩后的 (data, payload_json)。纯 CPU 操作，由调用方放到工作线程执行。
+
+    记录数组只做一次 UTF-8 编码，data 列与响应体共用同一份字节，不经过 Python 反序列化/再序列化；
+    聊天 JSON 键名高度重复，两列均压缩后以 BLOB 存储，减少写入/读取的页数。
+    """
+    data = records_json.encode("utf-8") if isinstance(records_json, str) else bytes(records_json)
+    return _compress_blob(data), _compress_blob(_snapshot_payload(data, share_id))
+
+
+def _loads_or(text: Any, default: Any) -> Any:
+    """解析 JSON 文本，空值或解析失败时返回 default（优先 orjson）。"""
+    if not text:
+        return default
+    try:
+        if orjson is not None:
+            return orjson.loads(text)
+        return json.loads(text)
+    except ValueError:
+        return default
+
+
+# 聊天记录中以 JSON 文本存储的字段及其空值默认
+_RECORD_JSON_FIELDS = (
+    ('mcp_tools_called', []),
+    ('mcp_results', []),
+    ('attachments', []),
+    ('usage', {}),
+)
+
+
+def _decode_record_json(record: Dict[str, Any]) -> Dict[str, Any]:
+    """就地解析聊天记录中的 JSON 字段（mcp_tools_called/mcp_results/attachments/usage），未查询的字段跳过。"""
+    for key, default in _RECORD_JSON_FIELDS:
+        if key in record:
+            record[key] = _loads_or(record[key], default)
+    return record
+
+
+# 历史查询可返回的列（chat_records_full 视图的全部列），fields 参数只能从中选取
+CHAT_RECORD_COLUMNS = (
+    "id", "session_id", "conversation_id", "user_id", "username",
+    "attachments", "usage", "user_input", "user_timestamp",
+    "mcp_tools_called", "mcp_results",
+    "ai_response", "ai_timestamp", "created_at",
+)
+
+
+def _record_projection(fields: Optional[Sequence[str]] = None) -> str:
+    """按白名单生成 SELECT 列表；fields 为空时返回全部列。未知列名抛出 ValueError。"""
+    if not fields:
+        return ", ".join(CHAT_RECORD_COLUMNS)
+    unknown = [f for f in fields if f not in CHAT_RECORD_COLUMNS]
+    if unknown:
+        raise ValueError(f"未知的聊天记录字段: {', '.join(map(str, unknown))}")
+    return ", ".join(dict.fromkeys(fields))
+
+
+def _json_col(col: str, default: str) -> str:
+    """SQL 片段：将 TEXT 列中的 JSON 原样嵌入 json_object，非法内容回退为 default。"""
+    return f"CASE WHEN json_valid({col}) THEN json({col}) ELSE json('{default}') END"
+
+
+# 在 SQLite 内把一条 chat_records 拼装为 JSON 对象，字段与 get_chat_history 返回的记录一致
+_RECORD_JSON_OBJECT = (
+    "json_object("
+    "'id', id, 'session_id', session_id, 'conversation_id', conversation_id, "
+    "'user_id', user_id, 'username', username, "
+    f"'attachments', {_json_col('attachments', '[]')}, "
+    f"'usage', {_json_col('usage', '{}')}, "
+    "'user_input', user_input, 'user_timestamp', user_timestamp, "
+    f"'mcp_tools_called', {_json_col('mcp_tools_called', '[]')}, "
+    f"'mcp_results', {_json_col('mcp_results', '[]')}, "
+    "'ai_response', ai_response, 'ai_timestamp', ai_timestamp, 'created_at', created_at)"
+)
+
+
+# 用户查询返回的列（_row_to_user 按列名转为字典）
+_USER_COLUMNS = "id, username, email, password_hash, credits, created_at, tushare_token, tushare_token_enabled"
+
+
+# mcp_results 编码后超过该长度（字符）时移出主表，写入 chat_payloads 侧表
+CHAT_PAYLOAD_INLINE_MAX = 2048
+
+
+# 读取聊天记录统一走该视图：mcp_results 优先取侧表中的大段内容，其余列来自主表。
+# 视图会被规划器展开，主表上的索引照常可用
+_CHAT_RECORDS_VIEW_SQL = """
+    CREATE VIEW chat_records_full AS
+    SELECT cr.id, cr.session_id, cr.conversation_id, cr.user_id, cr.username,
+           cr.attachments, cr.usage, cr.user_input, cr.user_timestamp,
+           cr.mcp_tools_called, COALESCE(p.mcp_results, cr.mcp_results) AS mcp_results,
+           cr.ai_response, cr.ai_timestamp, cr.created_at
+    FROM chat_records cr
+    LEFT JOIN chat_payloads p ON p.record_id = cr.id
+"""
+
+
+# 写入一条聊天记录（save_conversation 与 save_conversations_batch 共用同一语句，命中同一条预编译缓存）
+# user_timestamp/ai_timestamp 由 SQLite 生成，保持原有的本地时间 ISO 格式（毫秒精度），
+# 同一语句内 'now' 取值一致，两列相同
+_INSERT_CHAT_RECORD_SQL = """
+    INSERT INTO chat_records (
+        session_id, conversation_id, user_id, username, attachments, usage,
+        user_input, user_timestamp,
+        mcp_tools_called, mcp_results,
+        ai_response, ai_timestamp
+    ) VALUES (
+        ?, ?, ?, ?, ?, ?,
+        ?, strftime('%Y-%m-%dT%H:%M:%f', 'now', 'localtime'),
+        ?, ?,
+        ?, strftime('%Y-%m-%dT%H:%M:%f', 'now', 'localtime')
+    )
+"""
+
+
+def _chat_record_params(
+    session_id: str,
+    conversation_id: int,
+    user_input: str,
+    mcp_tools_called: List[Dict[str, Any]] = None,
+    mcp_results: List[Dict[str, Any]] = None,
+    ai_response: str = "",
+    username: Optional[str] = None,
+    user_id: Optional[int] = None,
+    attachments: List[Dict[str, Any]] = None,
+    usage: Dict[str, Any] = None,
+) -> Tuple[Tuple[Any, ...], Optional[str]]:
+    """按 _INSERT_CHAT_RECORD_SQL 的列顺序组装参数（JSON 字段在此编码，调用方应在进入写锁之前调用）
+
+    Returns:
+        (params, payload)：mcp_results 超过 CHAT_PAYLOAD_INLINE_MAX 时主表列置空，内容作为 payload 另存侧表
+    """
+    mcp_results_json = _dumps_text(mcp_results or [])
+    payload = None
+    if len(mcp_results_json) > CHAT_PAYLOAD_INLINE_MAX:
+        payload, mcp_results_json = mcp_results_json, None
+    params = (
+        session_id, conversation_id, user_id, username,
+        _dumps_text(attachments or []), _dumps_text(usage or {}),
+        user_input,
+        _dumps_text(mcp_tools_called or []), mcp_results_json,
+        ai_response,
+    )
+    return params, payload
+
+
+# 共享连接打开后执行的 PRAGMA（initialize() 也经由该连接执行，因此建表前即已生效）
+# - journal_mode=WAL 持久化在库文件上：写事务提交时读连接仍可并发读取
+#   （如 get_chat_history 与 save_conversation 重叠），提交只需追加 WAL 而非重写回滚日志
+# - synchronous=NORMAL：WAL 下只在检查点 fsync，频繁的小事务（保存对话/扣积分/验证码）不再逐次刷盘
+# - 其余为连接级设置：临时表放内存、64MB 页缓存、256MB mmap、锁等待 5 秒
+# 注意：不开启 foreign_keys，save_conversation 指定 conversation_id 续聊时不会补建 chat_sessions 行，
+# 且旧库中 chat_sessions.session_id 原本没有唯一约束，历史数据未经外键校验
+_CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA busy_timeout=5000",
+)
+
+
+# 新用户初始积分（users.credits 列默认值），进程启动时读取一次；
+# 解析为 int 后才拼入建表 DDL，环境变量内容不会进入 SQL 文本
+try:
+    DEFAULT_INITIAL_CREDITS = int(os.getenv("CREDITS_DEFAULT", "50"))
+except Exception:
+    DEFAULT_INITIAL_CREDITS = 50
+
+
+# 共享连接的预编译语句缓存容量（sqlite3 默认 128）。本模块的 SQL 均为固定字符串，
+# 加上 history 的几种过滤组合与 initialize 的 DDL，放大后热点语句（保存对话、扣积分、查用户、验证码）不会被挤出缓存
+STATEMENT_CACHE_SIZE = 256
+
+
+# 只读连接池大小：WAL 模式下读连接与写连接互不阻塞
+try:
+    READER_POOL_SIZE = max(1, int(os.getenv("DB_READER_POOL_SIZE", "4")))
+except Exception:
+    READER_POOL_SIZE = 4
+
+
+# 定期 PRAGMA optimize 的间隔（秒），让查询规划器统计信息随数据增长保持更新
+OPTIMIZE_INTERVAL_SECONDS = 6 * 3600
+
+
+# 过期/已使用验证码的清理间隔（秒）
+CODE_PURGE_INTERVAL_SECONDS = 3600
+
+
+# 验证码写入合并：在该时间窗口内到达的写入共用一次事务提交（一次 fsync）
+CODE_BATCH_WINDOW_SECONDS = 0.005
+CODE_BATCH_MAX_SIZE = 64
+
 
 class ChatDatabase:
     """聊天记录数据库管理类"""
@@ -28,13 +290,94 @@ class ChatDatabase:
         
         self.db_path = str(db_path)
         print(f"📁 数据库路径: {self.db_path}")
+        # 进程内唯一的写连接（首次使用时懒打开），所有写操作（含 app_main.db_pool.get_writer）通过 _write_lock 串行化
+        self._db: Optional[aiosqlite.Connection] = None
+        self._connect_lock = asyncio.Lock()
+        self._write_lock = asyncio.Lock()
+        # 只读连接池（首次读取时懒打开）：与写连接分离，读不到写事务中尚未提交的数据
+        self._readers: Optional[asyncio.Queue] = None
+        self._reader_conns: List[aiosqlite.Connection] = []
+        # 保存对话专用的同步连接：在线程池中一次完成 BEGIN/INSERT/COMMIT，同样只在持有 _write_lock 时使用（首次保存时懒打开）
+        self._sync_db: Optional[sqlite3.Connection] = None
+        # 分享快照点查专用的只读同步连接：查询与解码在一次 to_thread 内完成（首次读取时懒打开）
+        self._ro_db: Optional[sqlite3.Connection] = None
+        self._ro_lock = threading.Lock()
+        # 验证码批量写入队列与后台任务（首次写入时懒启动）
+        self._code_queue: Optional[asyncio.Queue] = None
+        self._code_writer_task: Optional[asyncio.Task] = None
+        # 定期优化任务与验证码清理任务（initialize 成功后启动）
+        self._optimize_task: Optional[asyncio.Task] = None
+        self._purge_codes_task: Optional[asyncio.Task] = None
+    
+    async def _open_connection(self, readonly: bool = False) -> aiosqlite.Connection:
+        """打开一个长连接并应用 PRAGMA；只读连接额外开启 query_only"""
+        db = await aiosqlite.connect(self.db_path, cached_statements=STATEMENT_CACHE_SIZE)
+        # sqlite3.Row：按列名取值，dict(row) 在 C 层完成，省去逐行 zip(columns, row)
+        db.row_factory = aiosqlite.Row
+        for pragma in _CONNECTION_PRAGMAS:
+            await db.execute(pragma)
+        if readonly:
+            await db.execute("PRAGMA query_only=ON")
+        return db
+
+    async def _conn(self) -> aiosqlite.Connection:
+        """返回写连接，首次调用时打开（替代每次调用 aiosqlite.connect 新建工作线程）"""
+        if self._db is None:
+            async with self._connect_lock:
+                if self._db is None:
+                    self._db = await self._open_connection()
+        return self._db
+    
+    @asynccontextmanager
+    async def _reader(self) -> AsyncIterator[aiosqlite.Connection]:
+        """从只读连接池借出一个连接，用完归还（不与写连接共用，避免读到未提交的事务）"""
+        if self._readers is None:
+            async with self._connect_lock:
+                if self._readers is None:
+                    queue: asyncio.Queue = asyncio.Queue()
+                    for _ in range(READER_POOL_SIZE):
+                        conn = await self._open_connection(readonly=True)
+                        self._reader_conns.append(conn)
+                        queue.put_nowait(conn)
+                    self._readers = queue
+        queue = self._readers
+        conn = await queue.get()
+        try:
+            yield conn
+        finally:
+            queue.put_nowait(conn)
+    
+    @asynccontextmanager
+    async def _writer(self) -> AsyncIterator[aiosqlite.Connection]:
+        """独占写：持有写锁，调用方负责 commit；异常或遗留未提交事务时回滚，避免泄漏给下一个写入者"""
+        db = await self._conn()
+        async with self._write_lock:
+            try:
+                yield db
+            except BaseException:
+                try:
+                    await db.rollback()
+                except Exception:
+                    pass
+                raise
+            if db.in_transaction:
+                await db.rollback()
     
+    def writer(self):
+        """供其他模块使用的独占写连接（与本类的写操作共用写连接和写锁）"""
+        return self._writer()
+
+    def reader(self):
+        """供其他模块使用的只读连接（从本类的只读连接池借出）"""
+        return self._reader()
+
     async def initialize(self):
         """初始化数据库表结构"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._writer() as db:
+                # 全部建表/补列/建索引放在一个事务里，只提交一次（一次 fsync）
+                await db.execute("BEGIN")
                 # 用户表
-                DEFAULT_INITIAL_CREDITS = int(os.getenv("CREDITS_DEFAULT", "50"))
                 await db.execute(f"""
                     CREATE TABLE IF NOT EXISTS users (
                         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -45,41 +388,50 @@ class ChatDatabase:
                         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                     )
                 """)
-                # 兼容旧库：尝试补充 users.email 列
-                try:
+                # 兼容旧库：先读一次现有列，只对缺失的列执行 ALTER（不再靠异常探测）
+                user_cols = await self._table_columns(db, "users")
+                # 补充 users.email 列
+                if "email" not in user_cols:
                     await db.execute("ALTER TABLE users ADD COLUMN email TEXT")
-                except Exception:
-                    pass
-                # 兼容旧库：尝试补充 users.credits 列并设置默认值
-                try:
+                # 补充 users.credits 列并设置默认值
+                if "credits" not in user_cols:
                     await db.execute(f"ALTER TABLE users ADD COLUMN credits INTEGER DEFAULT {DEFAULT_INITIAL_CREDITS}")
-                except Exception:
-                    pass
-                # 兼容旧库：尝试补充 users.tushare_token 列
-                try:
+                # 补充 users.tushare_token 列
+                if "tushare_token" not in user_cols:
                     await db.execute("ALTER TABLE users ADD COLUMN tushare_token TEXT")
-                except Exception:
-                    pass
-                # 兼容旧库：尝试补充 users.tushare_token_enabled 列（默认关闭）
-                try:
+                # 补充 users.tushare_token_enabled 列（默认关闭）
+                if "tushare_token_enabled" not in user_cols:
                     await db.execute("ALTER TABLE users ADD COLUMN tushare_token_enabled INTEGER DEFAULT 0")
-                except Exception:
-                    pass
                 # 为 email 创建唯一索引（允许多个 NULL，但非 NULL 唯一）
-                try:
-                    await db.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_email_unique ON users(email)")
-                except Exception:
-                    pass
+                await self._try_ddl(db, "CREATE UNIQUE INDEX IF NOT EXISTS idx_users_email_unique ON users(email)")
 
                 # 创建聊天会话表
                 await db.execute("""
                     CREATE TABLE IF NOT EXISTS chat_sessions (
                         id INTEGER PRIMARY KEY AUTOINCREMENT,
                         session_id TEXT NOT NULL,
+                        next_conversation_id INTEGER DEFAULT 0, -- 最近一次分配的 conversation_id
                         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                         updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                     )
                 """)
+                # 兼容旧库：补充 chat_sessions.next_conversation_id 列
+                if "next_conversation_id" not in await self._table_columns(db, "chat_sessions"):
+                    await db.execute("ALTER TABLE chat_sessions ADD COLUMN next_conversation_id INTEGER DEFAULT 0")
+                # start_conversation 的 UPSERT 需要 session_id 唯一；旧库的 INSERT OR IGNORE 没有唯一约束可依，
+                # 每次开新对话都会多插一行，建唯一索引前先去重（只保留每个会话最早的一行）
+                cursor = await db.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_chat_sessions_session_unique'"
+                )
+                if await cursor.fetchone() is None:
+                    await db.execute("""
+                        DELETE FROM chat_sessions
+                        WHERE id NOT IN (SELECT MIN(id) FROM chat_sessions GROUP BY session_id)
+                    """)
+                    await db.execute("""
+                        CREATE UNIQUE INDEX idx_chat_sessions_session_unique 
+                        ON chat_sessions(session_id)
+                    """)
                 
                 # 创建聊天记录表
                 await db.execute("""
@@ -130,70 +482,237 @@ class ChatDatabase:
                     CREATE INDEX IF NOT EXISTS idx_email_codes_created 
                     ON email_verification_codes(created_at)
                 """)
+                # verify_code 只查未使用的验证码：部分索引只含 used = 0 的行，体积小且按时间倒序直接取最新一条
+                await db.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_email_codes_active 
+                    ON email_verification_codes(email, purpose, created_at DESC)
+                    WHERE used = 0
+                """)
                 # 兼容旧库：已移除 msid 相关新增逻辑
-                # 兼容旧库：补充 username / user_id 列
-                try:
+                # 兼容旧库：补充 username / user_id / attachments / usage 列
+                record_cols = await self._table_columns(db, "chat_records")
+                if "username" not in record_cols:
                     await db.execute("ALTER TABLE chat_records ADD COLUMN username TEXT")
-                except Exception:
-                    pass
-                try:
+                if "user_id" not in record_cols:
                     await db.execute("ALTER TABLE chat_records ADD COLUMN user_id INTEGER")
-                except Exception:
-                    pass
-                # 兼容旧库：尝试补充 attachments 列
-                try:
+                if "attachments" not in record_cols:
                     await db.execute("ALTER TABLE chat_records ADD COLUMN attachments TEXT")
-                except Exception:
-                    pass
-                # 兼容旧库：尝试补充 usage 列
-                try:
+                if "usage" not in record_cols:
                     await db.execute("ALTER TABLE chat_records ADD COLUMN usage TEXT")
-                except Exception:
-                    pass
                 
                 # 创建索引以提高查询性能
+                # 按会话/线程取记录并按时间排序、取会话内最大 conversation_id：直接在复合索引上定位且有序
+                await db.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_chat_records_sess_conv_time 
+                    ON chat_records(session_id, conversation_id, created_at)
+                """)
+                # 按会话取最近 N 条（get_chat_history 未指定对话时）：倒序扫描该索引直接满足 ORDER BY created_at DESC, id DESC LIMIT
+                # 保持升序定义，隐含的 rowid 尾键随之倒序，平局按 id 排序也无需额外排序
+                await db.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_chat_records_session_created 
+                    ON chat_records(session_id, created_at)
+                """)
+                # 按用户取最近记录 / 线程列表
                 await db.execute("""
-                    CREATE INDEX IF NOT EXISTS idx_chat_records_session 
-                    ON chat_records(session_id)
+                    CREATE INDEX IF NOT EXISTS idx_chat_records_user_created 
+                    ON chat_records(username, created_at DESC)
                 """)
                 # 已移除 msid 索引
                 await db.execute("""
                     CREATE INDEX IF NOT EXISTS idx_chat_records_username 
                     ON chat_records(username)
                 """)
-                
-                await db.execute("""
-                    CREATE INDEX IF NOT EXISTS idx_chat_records_conversation 
-                    ON chat_records(conversation_id)
-                """)
+                # 单列 session_id 索引已被上面的复合索引前缀覆盖；conversation_id 从不单独作为查询条件
+                # 删除二者以减少 save_conversation 每次写入需要维护的索引
+                await db.execute("DROP INDEX IF EXISTS idx_chat_records_session")
+                await db.execute("DROP INDEX IF EXISTS idx_chat_records_conversation")
+                # 旧版分析脚本创建的 DATE(created_at) 表达式索引：图表已改为在 pandas 中按天分桶，不再使用
+                await db.execute("DROP INDEX IF EXISTS idx_chat_records_created_date")
+                await db.execute("DROP INDEX IF EXISTS idx_users_created_date")
                 
                 await db.execute("""
                     CREATE INDEX IF NOT EXISTS idx_chat_records_created 
                     ON chat_records(created_at)
                 """)
+                # 大段工具结果侧表：主表行保持短小，按会话/用户扫描时每页能容纳更多记录
+                await db.execute("""
+                    CREATE TABLE IF NOT EXISTS chat_payloads (
+                        record_id INTEGER PRIMARY KEY, -- chat_records.id
+                        mcp_results TEXT -- JSON，超过 CHAT_PAYLOAD_INLINE_MAX 的工具返回结果
+                    )
+                """)
+                # 删除聊天记录（清空会话/删除线程/回溯编辑）时同步删除侧表内容
+                await db.execute("""
+                    CREATE TRIGGER IF NOT EXISTS trg_chat_records_delete_payload
+                    AFTER DELETE ON chat_records
+                    BEGIN
+                        DELETE FROM chat_payloads WHERE record_id = OLD.id;
+                    END
+                """)
+                # 统计计数表：每个 (session_id, conversation_id) 一行记录数，由触发器随 chat_records 增删维护，
+                # get_stats 只读这张小表，不再扫描 chat_records。首次创建时从现有记录回填。
+                # 键允许 NULL 并按 IS 匹配：NULL 会话单独成行，COUNT(DISTINCT session_id) 与直接统计 chat_records 一致
+                cursor = await db.execute(
+                    "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'chat_stats_conversations'"
+                )
+                stats_row = await cursor.fetchone()
+                if stats_row is not None and "WITHOUT ROWID" in (stats_row[0] or "").upper():
+                    # 旧版以 COALESCE(session_id, '') 为主键，NULL 会话会并入空字符串会话：删除后按新结构重建
+                    await db.execute("DROP TRIGGER IF EXISTS trg_chat_records_stats_insert")
+                    await db.execute("DROP TRIGGER IF EXISTS trg_chat_records_stats_delete")
+                    await db.execute("DROP TABLE chat_stats_conversations")
+                    stats_row = None
+                await db.execute("""
+                    CREATE TABLE IF NOT EXISTS chat_stats_conversations (
+                        session_id TEXT,
+                        conversation_id INTEGER,
+                        records INTEGER NOT NULL DEFAULT 0
+                    )
+                """)
+                await db.execute("""
+                    CREATE UNIQUE INDEX IF NOT EXISTS idx_chat_stats_conversations_key
+                    ON chat_stats_conversations(session_id, conversation_id)
+                """)
+                if stats_row is None:
+                    await db.execute("""
+                        INSERT INTO chat_stats_conversations (session_id, conversation_id, records)
+                        SELECT session_id, conversation_id, COUNT(*)
+                        FROM chat_records
+                        GROUP BY session_id, conversation_id
+                    """)
+                await db.execute("""
+                    CREATE TRIGGER IF NOT EXISTS trg_chat_records_stats_insert
+                    AFTER INSERT ON chat_records
+                    BEGIN
+                        UPDATE chat_stats_conversations SET records = records + 1
+                        WHERE session_id IS NEW.session_id AND conversation_id IS NEW.conversation_id;
+                        INSERT INTO chat_stats_conversations (session_id, conversation_id, records)
+                        SELECT NEW.session_id, NEW.conversation_id, 1
+                        WHERE NOT EXISTS (
+                            SELECT 1 FROM chat_stats_conversations
+                            WHERE session_id IS NEW.session_id AND conversation_id IS NEW.conversation_id
+                        );
+                    END
+                """)
+                await db.execute("""
+                    CREATE TRIGGER IF NOT EXISTS trg_chat_records_stats_delete
+                    AFTER DELETE ON chat_records
+                    BEGIN
+                        UPDATE chat_stats_conversations SET records = records - 1
+                        WHERE session_id IS OLD.session_id AND conversation_id IS OLD.conversation_id;
+                        DELETE FROM chat_stats_conversations
+                        WHERE session_id IS OLD.session_id AND conversation_id IS OLD.conversation_id
+                          AND records <= 0;
+                    END
+                """)
+                # 视图定义可能随版本变化，每次启动重建
+                await db.execute("DROP VIEW IF EXISTS chat_records_full")
+                await db.execute(_CHAT_RECORDS_VIEW_SQL)
                 # 分享快照表：存储不可变只读快照，按 share_id 取回
                 await db.execute("""
                     CREATE TABLE IF NOT EXISTS shared_snapshots (
                         id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        share_id TEXT UNIQUE NOT NULL,
-                        data TEXT NOT NULL, -- JSON: 聊天记录数组
+                        share_id BLOB UNIQUE NOT NULL, -- 16 字节 UUID（旧库为 32 位十六进制文本）
+                        data TEXT NOT NULL, -- JSON: 聊天记录数组（新快照为 zlib 压缩后的 BLOB）
+                        payload_json BLOB, -- 预编码好的完整响应体（zlib 压缩），读取时解压后直接返回
                         created_by_user_id INTEGER,
                         created_by_username TEXT,
                         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                     )
                 """)
+                # 兼容旧库：补充 shared_snapshots.payload_json 列
+                if "payload_json" not in await self._table_columns(db, "shared_snapshots"):
+                    await db.execute("ALTER TABLE shared_snapshots ADD COLUMN payload_json BLOB")
                 
                 await db.commit()
+                # 启动时做一次完整分析（0x10002：不受“仅分析近期用过的表”限制），生成 sqlite_stat1 供规划器使用
+                await db.execute("PRAGMA optimize=0x10002")
                 print("✅ 数据库表结构初始化完成")
-                return True
+            if self._optimize_task is None or self._optimize_task.done():
+                self._optimize_task = asyncio.create_task(self._optimize_loop())
+            if self._purge_codes_task is None or self._purge_codes_task.done():
+                self._purge_codes_task = asyncio.create_task(self._purge_codes_loop())
+            return True
                 
         except Exception as e:
             print(f"❌ 数据库初始化失败: {e}")
             return False
 
+    def _insert_chat_records_sync(self, rows: List[Tuple[Tuple[Any, ...], Optional[str]]]) -> int:
+        """在工作线程中执行：单事务写入聊天记录，返回最后一条的记录ID。
+
+        调用方必须持有 _write_lock，因此同一时刻只有一个线程使用该连接。
+        aiosqlite 每次 execute/commit 都要经过其工作线程队列往返一次，这里整个事务只占一次 to_thread。
+        """
+        if self._sync_db is None:
+            conn = sqlite3.connect(
+                self.db_path,
+                check_same_thread=False,
+                isolation_level=None,
+                cached_statements=STATEMENT_CACHE_SIZE,
+            )
+            for pragma in _CONNECTION_PRAGMAS:
+                conn.execute(pragma)
+            self._sync_db = conn
+        conn = self._sync_db
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if len(rows) == 1:
+                last_id = conn.execute(_INSERT_CHAT_RECORD_SQL, rows[0][0]).lastrowid
+            else:
+                conn.executemany(_INSERT_CHAT_RECORD_SQL, [params for params, _ in rows])
+                # executemany 不设置 lastrowid；单事务插入的自增ID连续，由最后一个ID反推整段
+                last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+            first_id = last_id - len(rows) + 1
+            payloads = [(first_id + i, payload) for i, (_, payload) in enumerate(rows) if payload is not None]
+            if payloads:
+                conn.executemany("INSERT INTO chat_payloads (record_id, mcp_results) VALUES (?, ?)", payloads)
+            conn.execute("COMMIT")
+            return last_id
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    async def _insert_chat_records(self, rows: List[Tuple[Tuple[Any, ...], Optional[str]]]) -> int:
+        """持有写锁，在线程池中写入聊天记录（rows 为 _chat_record_params 的返回值列表），返回最后一条的记录ID"""
+        async with self._write_lock:
+            return await asyncio.to_thread(self._insert_chat_records_sync, rows)
+
+    @staticmethod
+    async def _table_columns(db: aiosqlite.Connection, table: str) -> set:
+        """读取表的现有列名"""
+        cursor = await db.execute(f"PRAGMA table_info({table})")
+        return {row[1] for row in await cursor.fetchall()}
+
+    @staticmethod
+    async def _try_ddl(db: aiosqlite.Connection, sql: str) -> None:
+        """在保存点内执行可能失败的 DDL（如旧库已有重复邮箱时建唯一索引），失败只回滚该语句，不影响外层事务"""
+        await db.execute("SAVEPOINT ddl")
+        try:
+            await db.execute(sql)
+        except Exception:
+            await db.execute("ROLLBACK TO ddl")
+        await db.execute("RELEASE ddl")
+
+    async def _optimize_loop(self):
+        """后台任务：定期执行轻量的 PRAGMA optimize（SQLite 自行判断哪些表需要重新分析）"""
+        while True:
+            await asyncio.sleep(OPTIMIZE_INTERVAL_SECONDS)
+            try:
+                async with self._writer() as db:
+                    await db.execute("PRAGMA optimize")
+            except Exception as e:
+                print(f"⚠️ PRAGMA optimize 失败: {e}")
+
+    async def _purge_codes_loop(self):
+        """后台任务：启动时及之后每隔 CODE_PURGE_INTERVAL_SECONDS 清理一次验证码表"""
+        while True:
+            await self.purge_verification_codes()
+            await asyncio.sleep(CODE_PURGE_INTERVAL_SECONDS)
+
     async def create_user(self, username: str, email: str, password_hash: str) -> bool:
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._writer() as db:
                 await db.execute(
                     "INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)",
                     (username, email, password_hash)
@@ -204,50 +723,35 @@ class ChatDatabase:
             print(f"❌ 创建用户失败: {e}")
             return False
 
+    @staticmethod
+    def _row_to_user(row: aiosqlite.Row) -> Dict[str, Any]:
+        """将按 _USER_COLUMNS 查询的用户行转为字典"""
+        user = dict(row)
+        user["tushare_token_enabled"] = bool(user["tushare_token_enabled"])
+        return user
+
     async def get_user_by_username(self, username: str) -> Optional[Dict[str, Any]]:
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._reader() as db:
                 cursor = await db.execute(
-                    "SELECT id, username, email, password_hash, credits, created_at, tushare_token, tushare_token_enabled FROM users WHERE username = ?",
+                    f"SELECT {_USER_COLUMNS} FROM users WHERE username = ?",
                     (username,)
                 )
                 row = await cursor.fetchone()
-                if not row:
-                    return None
-                return {
-                    "id": row[0],
-                    "username": row[1],
-                    "email": row[2],
-                    "password_hash": row[3],
-                    "credits": row[4],
-                    "created_at": row[5],
-                    "tushare_token": row[6] if len(row) > 6 else None,
-                    "tushare_token_enabled": bool(row[7]) if len(row) > 7 else False,
-                }
+                return self._row_to_user(row) if row else None
         except Exception as e:
             print(f"❌ 查询用户失败: {e}")
             return None
 
     async def get_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._reader() as db:
                 cursor = await db.execute(
-                    "SELECT id, username, email, password_hash, credits, created_at, tushare_token, tushare_token_enabled FROM users WHERE email = ?",
+                    f"SELECT {_USER_COLUMNS} FROM users WHERE email = ?",
                     (email,)
                 )
                 row = await cursor.fetchone()
-                if not row:
-                    return None
-                return {
-                    "id": row[0],
-                    "username": row[1],
-                    "email": row[2],
-                    "password_hash": row[3],
-                    "credits": row[4],
-                    "created_at": row[5],
-                    "tushare_token": row[6] if len(row) > 6 else None,
-                    "tushare_token_enabled": bool(row[7]) if len(row) > 7 else False,
-                }
+                return self._row_to_user(row) if row else None
         except Exception as e:
             print(f"❌ 通过邮箱查询用户失败: {e}")
             return None
@@ -255,7 +759,7 @@ class ChatDatabase:
     async def get_user_credits_by_id(self, user_id: int) -> Optional[int]:
         """按用户ID获取剩余积分。"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._reader() as db:
                 cursor = await db.execute(
                     "SELECT credits FROM users WHERE id = ?",
                     (user_id,)
@@ -273,15 +777,13 @@ class ChatDatabase:
         if amount <= 0:
             return True
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                await db.execute(
+            async with self._writer() as db:
+                cursor = await db.execute(
                     "UPDATE users SET credits = credits - ? WHERE id = ? AND credits >= ?",
                     (amount, user_id, amount)
                 )
-                # SQLite中可用 changes() 判断受影响行数
-                cursor = await db.execute("SELECT changes()")
-                changes = (await cursor.fetchone())[0]
-                if changes and int(changes) > 0:
+                # rowcount 即 sqlite3_changes()，无需再发一次 SELECT changes()
+                if cursor.rowcount and cursor.rowcount > 0:
                     await db.commit()
                     return True
                 return False
@@ -294,7 +796,7 @@ class ChatDatabase:
         if amount <= 0:
             return True
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._writer() as db:
                 await db.execute(
                     "UPDATE users SET credits = credits + ? WHERE id = ?",
                     (amount, user_id)
@@ -315,7 +817,7 @@ class ChatDatabase:
             only_update_enabled: 仅更新启用状态，不修改token（当用户只想切换开关时）
         """
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._writer() as db:
                 if only_update_enabled and enabled is not None:
                     # 仅更新启用状态，不改变 token
                     await db.execute(
@@ -347,7 +849,7 @@ class ChatDatabase:
             包含 token 和 enabled 的字典，或 None
         """
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._reader() as db:
                 cursor = await db.execute(
                     "SELECT tushare_token, tushare_token_enabled FROM users WHERE id = ?",
                     (user_id,)
@@ -356,8 +858,8 @@ class ChatDatabase:
                 if not row:
                     return None
                 return {
-                    "token": row[0],
-                    "enabled": bool(row[1]) if len(row) > 1 else False
+                    "token": row["tushare_token"],
+                    "enabled": bool(row["tushare_token_enabled"])
                 }
         except Exception as e:
             print(f"❌ 查询用户 Tushare Token 失败: {e}")
@@ -365,41 +867,92 @@ class ChatDatabase:
 
     async def can_send_code(self, email: str, purpose: str, min_interval_seconds: int = 60) -> bool:
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._reader() as db:
+                # 只需判断是否存在，EXISTS 命中第一行即返回，不必数完所有匹配行
                 cursor = await db.execute(
                     """
-                    SELECT COUNT(*) FROM email_verification_codes
-                    WHERE email = ? AND purpose = ? 
-                      AND datetime(created_at) >= datetime('now', ?)
+                    SELECT EXISTS(
+                        SELECT 1 FROM email_verification_codes
+                        WHERE email = ? AND purpose = ? 
+                          AND datetime(created_at) >= datetime('now', ?)
+                    )
                     """,
                     (email, purpose, f'-{min_interval_seconds} seconds')
                 )
-                cnt = (await cursor.fetchone())[0]
-                return cnt == 0
+                recent = (await cursor.fetchone())[0]
+                return recent == 0
         except Exception as e:
             print(f"❌ 发送验证码频率检查失败: {e}")
             return False
 
     async def create_verification_code(self, email: str, code: str, purpose: str, ttl_minutes: int = 10) -> bool:
+        """保存验证码。写入交给后台合并任务，返回时已提交。"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                expires_at = (datetime.now() + timedelta(minutes=ttl_minutes)).isoformat()
-                await db.execute(
-                    """
-                    INSERT INTO email_verification_codes (email, code, purpose, expires_at)
-                    VALUES (?, ?, ?, ?)
-                    """,
-                    (email, code, purpose, expires_at)
-                )
-                await db.commit()
-                return True
+            # 过期时间由 SQLite 按 UTC 计算，与 created_at 及 verify_code 中的 datetime('now') 同一时基
+            expires_modifier = f'+{int(ttl_minutes)} minutes'
+            if self._code_queue is None:
+                self._code_queue = asyncio.Queue()
+            if self._code_writer_task is None or self._code_writer_task.done():
+                self._code_writer_task = asyncio.create_task(self._code_writer_loop())
+            future = asyncio.get_running_loop().create_future()
+            self._code_queue.put_nowait(((email, code, purpose, expires_modifier), future))
+            return await future
         except Exception as e:
             print(f"❌ 保存验证码失败: {e}")
             return False
 
+    async def _code_writer_loop(self):
+        """后台任务：把短时间内到达的验证码写入合并为一个事务。"""
+        queue = self._code_queue
+        loop = asyncio.get_running_loop()
+        batch = []
+        try:
+            while True:
+                batch = [await queue.get()]
+                deadline = loop.time() + CODE_BATCH_WINDOW_SECONDS
+                while len(batch) < CODE_BATCH_MAX_SIZE:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+                try:
+                    async with self._writer() as db:
+                        await db.executemany(
+                            """
+                            INSERT INTO email_verification_codes (email, code, purpose, expires_at)
+                            VALUES (?, ?, ?, datetime('now', ?))
+                            """,
+                            [params for params, _ in batch]
+                        )
+                        await db.commit()
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_result(True)
+                except Exception as e:
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+        except BaseException:
+            # 被 close() 取消等情况：已取出但未完成的批次与队列中剩余请求都要结束，避免调用方永久等待
+            self._fail_pending_codes(queue, batch)
+            raise
+
+    @staticmethod
+    def _fail_pending_codes(queue: Optional[asyncio.Queue], batch: Sequence = ()) -> None:
+        """以异常结束批次及队列中尚未写入的验证码请求"""
+        pending = list(batch)
+        while queue is not None and not queue.empty():
+            pending.append(queue.get_nowait())
+        for _, future in pending:
+            if not future.done():
+                future.set_exception(RuntimeError("验证码写入任务已停止"))
+
     async def verify_code(self, email: str, code: str, purpose: str) -> bool:
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._writer() as db:
                 cursor = await db.execute(
                     """
                     SELECT id FROM email_verification_codes
@@ -423,20 +976,41 @@ class ChatDatabase:
             print(f"❌ 校验验证码失败: {e}")
             return False
     
+    async def purge_verification_codes(self) -> int:
+        """删除已使用（超过 1 小时，保留给 can_send_code 频率检查）或过期超过 1 天的验证码，返回删除条数"""
+        try:
+            async with self._writer() as db:
+                cursor = await db.execute(
+                    """
+                    DELETE FROM email_verification_codes
+                    WHERE (used = 1 AND datetime(created_at) <= datetime('now', '-1 hour'))
+                       OR datetime(expires_at) <= datetime('now', '-1 day')
+                    """
+                )
+                await db.commit()
+                deleted = cursor.rowcount or 0
+            if deleted:
+                print(f"🧹 已清理验证码 {deleted} 条")
+            return deleted
+        except Exception as e:
+            print(f"❌ 清理验证码失败: {e}")
+            return 0
+
     async def start_conversation(self, session_id: str = "default") -> int:
         """开始新的对话，返回conversation_id"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                # 确保session存在
-                await db.execute("""
-                    INSERT OR IGNORE INTO chat_sessions (session_id) VALUES (?)
-                """, (session_id,))
-                
-                # 获取下一个conversation_id
+            async with self._writer() as db:
+                # 一条 UPSERT 完成“确保 session 存在 + 分配下一个 conversation_id”，计数器存于会话行，
+                # 并发开启的对话各得不同ID。取值不小于记录中已有的最大 conversation_id + 1，
+                # 兼容计数器列出现之前的旧数据以及按指定 conversation_id 续聊写入的记录
                 cursor = await db.execute("""
-                    SELECT COALESCE(MAX(conversation_id), 0) + 1 
-                    FROM chat_records WHERE session_id = ?
-                """, (session_id,))
+                    INSERT INTO chat_sessions (session_id, next_conversation_id)
+                    VALUES (?, (SELECT COALESCE(MAX(conversation_id), 0) + 1 FROM chat_records WHERE session_id = ?))
+                    ON CONFLICT(session_id) DO UPDATE SET
+                        next_conversation_id = MAX(COALESCE(next_conversation_id, 0) + 1, excluded.next_conversation_id),
+                        updated_at = CURRENT_TIMESTAMP
+                    RETURNING next_conversation_id
+                """, (session_id, session_id))
                 conversation_id = (await cursor.fetchone())[0]
                 
                 await db.commit()
@@ -470,59 +1044,75 @@ class ChatDatabase:
             conversation_id: 对话ID，如果为None则自动生成
         """
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                if conversation_id is None:
-                    conversation_id = await self.start_conversation(session_id)
-                
-                # 将工具调用和结果转换为JSON
-                mcp_tools_json = json.dumps(mcp_tools_called or [], ensure_ascii=False)
-                mcp_results_json = json.dumps(mcp_results or [], ensure_ascii=False)
-                attachments_json = json.dumps(attachments or [], ensure_ascii=False)
-                
-                cursor = await db.execute("""
-                    INSERT INTO chat_records (
-                        session_id, conversation_id, user_id, username, attachments, usage,
-                        user_input, user_timestamp,
-                        mcp_tools_called, mcp_results,
-                        ai_response, ai_timestamp
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    session_id, conversation_id, user_id, username, attachments_json, json.dumps(usage or {}, ensure_ascii=False),
-                    user_input, datetime.now().isoformat(),
-                    mcp_tools_json, mcp_results_json,
-                    ai_response, datetime.now().isoformat()
-                ))
-                
-                await db.commit()
-                inserted_id = cursor.lastrowid if cursor else None
-                print(f"💾 对话记录已保存 (session={session_id}, conversation={conversation_id}, id={inserted_id})")
-                return inserted_id
+            # start_conversation 自己持有写锁，必须在进入写锁之前调用
+            if conversation_id is None:
+                conversation_id = await self.start_conversation(session_id)
+            # 将工具调用和结果转换为JSON（在进入写锁之前完成，编码大段工具输出时不阻塞其他写入）
+            record = _chat_record_params(
+                session_id, conversation_id, user_input,
+                mcp_tools_called=mcp_tools_called, mcp_results=mcp_results, ai_response=ai_response,
+                username=username, user_id=user_id, attachments=attachments, usage=usage,
+            )
+            inserted_id = await self._insert_chat_records([record])
+            print(f"💾 对话记录已保存 (session={session_id}, conversation={conversation_id}, id={inserted_id})")
+            return inserted_id
                 
         except Exception as e:
             print(f"❌ 保存对话记录失败: {e}")
             return None
 
+    async def save_conversations_batch(self, rows: List[Dict[str, Any]]) -> List[int]:
+        """在一个事务中批量保存多条对话记录（executemany，一次提交/一次 fsync），返回按输入顺序的记录ID。
+
+        每个元素的键与 save_conversation 的参数相同。未指定 conversation_id 的记录，
+        同一 session_id 在本批次内共用一个新建的对话线程。失败时整批回滚并返回空列表。
+        """
+        if not rows:
+            return []
+        try:
+            # 新对话线程在进入写锁之前分配（start_conversation 自己持有写锁）
+            new_conversations: Dict[str, int] = {}
+            records = []
+            for row in rows:
+                row = dict(row)
+                session_id = row.pop("session_id", None) or "default"
+                conversation_id = row.pop("conversation_id", None)
+                if conversation_id is None:
+                    if session_id not in new_conversations:
+                        new_conversations[session_id] = await self.start_conversation(session_id)
+                    conversation_id = new_conversations[session_id]
+                records.append(_chat_record_params(session_id, conversation_id, **row))
+            last_id = await self._insert_chat_records(records)
+            first_id = last_id - len(records) + 1
+            print(f"💾 批量保存对话记录 {len(records)} 条 (id={first_id}..{last_id})")
+            return list(range(first_id, last_id + 1))
+        except Exception as e:
+            print(f"❌ 批量保存对话记录失败: {e}")
+            return []
+
     # msid 相关方法已废弃
 
     async def get_threads_by_username(self, username: str, limit: int = 100) -> List[Dict[str, Any]]:
         """按用户名返回线程列表。"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._reader() as db:
                 cursor = await db.execute(
                     """
                     SELECT session_id, conversation_id,
                            MIN(created_at) AS first_time,
                            MAX(created_at) AS last_time,
                            COUNT(*) AS message_count,
-                           COALESCE(
-                               (SELECT user_input FROM chat_records cr2 
-                                WHERE cr2.session_id = cr.session_id AND cr2.conversation_id = cr.conversation_id 
-                                  AND cr2.username = cr.username
-                                ORDER BY cr2.created_at ASC LIMIT 1),
-                               ''
-                           ) AS first_user_input
-                    FROM chat_records cr
-                    WHERE username = ?
+                           COALESCE(MAX(CASE WHEN rn = 1 THEN user_input END), '') AS first_user_input
+                    FROM (
+                        -- 一次扫描内用窗口函数标记每个线程的首条记录，避免逐线程的关联子查询
+                        SELECT session_id, conversation_id, created_at, user_input,
+                               ROW_NUMBER() OVER (
+                                   PARTITION BY session_id, conversation_id
+                                   ORDER BY created_at ASC, id ASC
+                               ) AS rn
+                        FROM chat_records
+                        WHERE username = ?
+                    )
                     GROUP BY session_id, conversation_id
                     ORDER BY last_time DESC
                     LIMIT ?
@@ -530,8 +1120,7 @@ class ChatDatabase:
                     (username, limit),
                 )
                 rows = await cursor.fetchall()
-                columns = [desc[0] for desc in cursor.description]
-                return [dict(zip(columns, row)) for row in rows]
+                return [dict(row) for row in rows]
         except Exception as e:
             print(f"❌ 按用户名获取线程列表失败: {e}")
             return []
@@ -540,7 +1129,8 @@ class ChatDatabase:
         self, 
         session_id: str = "default", 
         limit: int = 50,
-        conversation_id: int = None
+        conversation_id: int = None,
+        fields: Optional[Sequence[str]] = None,
     ) -> List[Dict[str, Any]]:
         """获取聊天历史记录
         
@@ -548,108 +1138,108 @@ class ChatDatabase:
             session_id: 会话ID
             limit: 返回记录数量限制
             conversation_id: 特定对话ID，如果指定则只返回该对话
+            fields: 只返回这些列（取自 CHAT_RECORD_COLUMNS），默认全部；不取 mcp_results 时不会读取侧表
         """
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            columns = _record_projection(fields)
+            async with self._reader() as db:
                 if conversation_id is not None:
                     # 获取特定对话
-                    cursor = await db.execute("""
-                        SELECT * FROM chat_records 
+                    cursor = await db.execute(f"""
+                        SELECT {columns} FROM chat_records_full 
                         WHERE session_id = ? AND conversation_id = ?
                         ORDER BY created_at ASC
                     """, (session_id, conversation_id))
                 else:
-                    # 获取最近的对话记录
-                    cursor = await db.execute("""
-                        SELECT * FROM (
-                            SELECT * FROM chat_records 
-                            WHERE session_id = ?
-                            ORDER BY created_at DESC 
-                            LIMIT ?
-                        ) ORDER BY created_at ASC
+                    # 获取最近的对话记录：沿 (session_id, created_at) 索引倒序扫描，取满 limit 即停，无需排序
+                    cursor = await db.execute(f"""
+                        SELECT {columns} FROM chat_records_full 
+                        WHERE session_id = ?
+                        ORDER BY created_at DESC, id DESC
+                        LIMIT ?
                     """, (session_id, limit))
                 
                 rows = await cursor.fetchall()
-                columns = [desc[0] for desc in cursor.description]
-                
                 records = []
                 for row in rows:
-                    record = dict(zip(columns, row))
+                    record = dict(row)
                     
                     # 解析JSON字段
-                    try:
-                        record['mcp_tools_called'] = json.loads(record['mcp_tools_called'] or '[]')
-                        record['mcp_results'] = json.loads(record['mcp_results'] or '[]')
-                        record['attachments'] = json.loads(record.get('attachments') or '[]')
-                        record['usage'] = json.loads(record.get('usage') or '{}')
-                    except json.JSONDecodeError:
-                        record['mcp_tools_called'] = []
-                        record['mcp_results'] = []
-                        record['attachments'] = []
-                        record['usage'] = {}
+                    _decode_record_json(record)
                     
                     records.append(record)
                 
-                # 如果不是特定对话，需要反转顺序（最新的在前面）
-                if conversation_id is None:
-                    records.reverse()
-                
+                # 不是特定对话时，查询已按时间倒序返回（最新的在前面）
                 return records
                 
         except Exception as e:
             print(f"❌ 获取聊天历史失败: {e}")
             return []
 
-    async def get_chat_history_by_user(
+    async def get_history_json_with_total(
         self,
         username: str,
         limit: int = 50,
         conversation_id: int = None,
         session_id: Optional[str] = None,
-    ) -> List[Dict[str, Any]]:
-        """获取指定用户的聊天历史，可选按会话过滤。"""
-        try:
-            async with aiosqlite.connect(self.db_path) as db:
-                params = []
-                sql = "SELECT * FROM chat_records WHERE username = ?"
-                params.append(username)
-                if session_id is not None:
-                    sql += " AND session_id = ?"
-                    params.append(session_id)
-                if conversation_id is not None:
-                    sql += " AND conversation_id = ? ORDER BY created_at ASC"
-                    params.append(conversation_id)
-                else:
-                    sql += " ORDER BY created_at DESC LIMIT ?"
-                    params.append(limit)
+        offset: int = 0,
+    ) -> Tuple[bytes, int, int]:
+        """按用户（可选会话/对话）过滤聊天历史，一次查询同时返回记录与匹配总数，记录数组直接在 SQLite 内拼装为 JSON。
+
+        总数通过窗口函数 COUNT(*) OVER () 在 LIMIT 之前计算，避免再发一次统计查询；
+        offset 越过末尾导致本页为空时，窗口函数看不到页外的行，此时单独 COUNT(*) 取得真实总数。
+        offset 仅在未指定 conversation_id 时生效（按时间倒序向更早的记录翻页）。
+        JSON 字段以原文嵌入（json_object + json_group_array），不经过 Python 反序列化/再序列化，
+        适合只需把记录转发给 HTTP 响应的调用方。
+
+        Returns:
+            (data, total, returned)：data 为 UTF-8 JSON 数组字节，total 为匹配总数，returned 为本页条数
+        """
+        params: List[Any] = [username]
+        where = "username = ?"
+        if session_id is not None:
+            where += " AND session_id = ?"
+            params.append(session_id)
+        if conversation_id is not None:
+            where += " AND conversation_id = ?"
+            params.append(conversation_id)
+            recs = f"SELECT *, COUNT(*) OVER () AS _total FROM chat_records_full WHERE {where}"
+        else:
+            # 取按时间倒序的一页，再按时间正序输出
+            recs = (
+                f"SELECT *, COUNT(*) OVER () AS _total FROM chat_records_full WHERE {where} "
+                "ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?"
+            )
+            offset = max(0, int(offset or 0))
+            params.extend([limit, offset])
+        sql = f"""
+            SELECT json_group_array(json(obj)) AS data, COUNT(*) AS n, MAX(_total) AS total
+            FROM (
+                SELECT {_RECORD_JSON_OBJECT} AS obj, _total
+                FROM ({recs})
+                ORDER BY created_at ASC, id ASC
+            )
+        """
+        try:
+            async with self._reader() as db:
                 cursor = await db.execute(sql, tuple(params))
-                rows = await cursor.fetchall()
-                columns = [desc[0] for desc in cursor.description]
-                records = []
-                for row in rows:
-                    record = dict(zip(columns, row))
-                    try:
-                        record['mcp_tools_called'] = json.loads(record['mcp_tools_called'] or '[]')
-                        record['mcp_results'] = json.loads(record['mcp_results'] or '[]')
-                        record['attachments'] = json.loads(record.get('attachments') or '[]')
-                        record['usage'] = json.loads(record.get('usage') or '{}')
-                    except json.JSONDecodeError:
-                        record['mcp_tools_called'] = []
-                        record['mcp_results'] = []
-                        record['attachments'] = []
-                        record['usage'] = {}
-                    records.append(record)
-                if conversation_id is None:
-                    records.reverse()
-                return records
+                row = await cursor.fetchone()
+                if not row or not row["n"]:
+                    if conversation_id is not None or not offset:
+                        return b"[]", 0, 0
+                    cursor = await db.execute(
+                        f"SELECT COUNT(*) FROM chat_records WHERE {where}", tuple(params[:-2])
+                    )
+                    return b"[]", int((await cursor.fetchone())[0]), 0
+                return row["data"].encode("utf-8"), int(row["total"] or 0), int(row["n"])
         except Exception as e:
             print(f"❌ 获取用户聊天历史失败: {e}")
-            return []
+            return b"[]", 0, 0
     
     async def clear_history(self, session_id: str = "default") -> bool:
         """清空指定会话的聊天历史"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._writer() as db:
                 await db.execute("""
                     DELETE FROM chat_records WHERE session_id = ?
                 """, (session_id,))
@@ -669,7 +1259,7 @@ class ChatDatabase:
     async def delete_conversation(self, session_id: str, conversation_id: int) -> bool:
         """删除指定会话中的某个对话线程"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._writer() as db:
                 await db.execute(
                     "DELETE FROM chat_records WHERE session_id = ? AND conversation_id = ?",
                     (session_id, conversation_id),
@@ -689,7 +1279,7 @@ class ChatDatabase:
             from_id_inclusive: 起始记录ID（包含）
         """
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._writer() as db:
                 await db.execute(
                     "DELETE FROM chat_records WHERE session_id = ? AND conversation_id = ? AND id >= ?",
                     (session_id, conversation_id, from_id_inclusive),
@@ -704,22 +1294,17 @@ class ChatDatabase:
     async def get_stats(self) -> Dict[str, Any]:
         """获取数据库统计信息"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                # 总记录数
-                cursor = await db.execute("SELECT COUNT(*) FROM chat_records")
-                total_records = (await cursor.fetchone())[0]
-                
-                # 会话数
-                cursor = await db.execute("SELECT COUNT(DISTINCT session_id) FROM chat_records")
-                total_sessions = (await cursor.fetchone())[0]
-                
-                # 对话数
-                cursor = await db.execute("SELECT COUNT(DISTINCT conversation_id) FROM chat_records")
-                total_conversations = (await cursor.fetchone())[0]
-                
-                # 最近记录时间
-                cursor = await db.execute("SELECT MAX(created_at) FROM chat_records")
-                latest_record = (await cursor.fetchone())[0]
+            async with self._reader() as db:
+                # 总记录数 / 会话数 / 对话数：读触发器维护的计数表（每个对话一行），与 chat_records 的规模无关；
+                # 唯一索引有序，按会话去重不建临时 B 树，NULL 会话不计入会话数。最近记录时间直接取 created_at 索引末端
+                cursor = await db.execute("""
+                    SELECT COALESCE(SUM(records), 0),
+                           COUNT(DISTINCT session_id),
+                           COUNT(*),
+                           (SELECT MAX(created_at) FROM chat_records)
+                    FROM chat_stats_conversations
+                """)
+                total_records, total_sessions, total_conversations, latest_record = await cursor.fetchone()
                 
                 return {
                     "total_records": total_records,
@@ -733,17 +1318,50 @@ class ChatDatabase:
             print(f"❌ 获取统计信息失败: {e}")
             return {}
     
-    async def create_shared_snapshot(self, records: List[Dict[str, Any]], created_by_user_id: int = None, created_by_username: str = None) -> str:
-        """创建分享快照，返回 share_id。"""
+    async def create_shared_snapshot_from_query(
+        self,
+        username: str,
+        session_id: str,
+        conversation_id: int = None,
+        limit: int = 100,
+        created_by_user_id: int = None,
+    ) -> str:
+        """按用户与会话（可选对话）筛选聊天记录并生成分享快照。
+
+        记录在 SQLite 内通过 json_object/json_group_array 拼装为 JSON 数组，不经过 Python 反序列化/再序列化；
+        随后在一次 asyncio.to_thread 中完成编码、拼装响应体与压缩，再写入。没有匹配记录时不写入，返回空字符串。
+        """
+        params: List[Any] = [username, session_id]
+        where = "username = ? AND session_id = ?"
+        if conversation_id is not None:
+            where += " AND conversation_id = ?"
+            params.append(conversation_id)
+            recs = f"SELECT * FROM chat_records_full WHERE {where} ORDER BY created_at ASC"
+        else:
+            # 取最近 limit 条，再按时间正序输出
+            recs = f"SELECT * FROM (SELECT * FROM chat_records_full WHERE {where} ORDER BY created_at DESC LIMIT ?) ORDER BY created_at ASC"
+            params.append(limit)
+        sql = f"""
+            SELECT json_group_array(json(obj)) AS data, COUNT(*) AS n
+            FROM (SELECT {_RECORD_JSON_OBJECT} AS obj FROM ({recs}))
+        """
         try:
-            share_id = uuid.uuid4().hex  # 不可推断ID
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._reader() as db:
+                cursor = await db.execute(sql, tuple(params))
+                row = await cursor.fetchone()
+            if not row or not row[1]:
+                return ""
+            share_uuid = uuid.uuid4()  # 不可推断ID；库内存 16 字节，对外返回十六进制
+            share_id = share_uuid.hex
+            # UTF-8 编码、拼装响应体与压缩全部放到工作线程，大快照不阻塞事件循环
+            data, payload_json = await asyncio.to_thread(_encode_snapshot, row[0], share_id)
+            async with self._writer() as db:
                 await db.execute(
                     """
-                    INSERT INTO shared_snapshots (share_id, data, created_by_user_id, created_by_username)
-                    VALUES (?, ?, ?, ?)
+                    INSERT INTO shared_snapshots (share_id, data, payload_json, created_by_user_id, created_by_username)
+                    VALUES (?, ?, ?, ?, ?)
                     """,
-                    (share_id, json.dumps(records or [], ensure_ascii=False), created_by_user_id, created_by_username)
+                    (share_uuid.bytes, data, payload_json, created_by_user_id, username)
                 )
                 await db.commit()
             return share_id
@@ -751,25 +1369,101 @@ class ChatDatabase:
             print(f"❌ 创建分享快照失败: {e}")
             return ""
 
-    async def get_shared_snapshot(self, share_id: str) -> List[Dict[str, Any]]:
-        """按 share_id 读取分享快照，失败返回空数组。"""
-        try:
-            async with aiosqlite.connect(self.db_path) as db:
-                cursor = await db.execute(
-                    "SELECT data FROM shared_snapshots WHERE share_id = ? LIMIT 1",
-                    (share_id,)
+    def _read_snapshot_sync(self, sql: str, keys: Tuple[bytes, str], decode: Callable[[Any], Any]) -> Any:
+        """在工作线程中执行：用只读连接点查分享快照并解码，未命中时 decode(None)。
+
+        aiosqlite 的 execute/fetchone 各需经其工作线程队列往返一次，之后解压还要再跳一次线程；
+        这里查询与解码合并为一次 to_thread。未使用 cache=shared：共享缓存与 WAL 并用反而引入表级锁。
+        """
+        with self._ro_lock:
+            if self._ro_db is None:
+                self._ro_db = sqlite3.connect(
+                    Path(self.db_path).as_uri() + "?mode=ro",
+                    uri=True,
+                    check_same_thread=False,
                 )
-                row = await cursor.fetchone()
-                if not row:
-                    return []
-                try:
-                    return json.loads(row[0] or "[]")
-                except Exception:
-                    return []
+            row = self._ro_db.execute(sql, keys).fetchone()
+        return decode(row)
+
+    async def _read_snapshot(self, sql: str, keys: Tuple[bytes, str], decode: Callable[[Any], Any]) -> Any:
+        """分享快照点查：优先走只读同步连接，打开或查询失败时回退共享 aiosqlite 连接"""
+        try:
+            return await asyncio.to_thread(self._read_snapshot_sync, sql, keys, decode)
+        except sqlite3.Error as e:
+            print(f"⚠️ 只读连接读取分享快照失败，回退共享连接: {e}")
+        async with self._reader() as db:
+            cursor = await db.execute(sql, keys)
+            row = await cursor.fetchone()
+        return await asyncio.to_thread(decode, row)
+
+    async def get_shared_snapshot_payload(self, share_id: str) -> Optional[bytes]:
+        """按 share_id 读取预编码的响应体；旧快照无 payload_json 时由 data 现场生成。不存在返回 None。"""
+        keys = _share_keys(share_id)
+        if keys is None:
+            return None
+
+        def decode(row) -> Optional[bytes]:
+            if not row:
+                return None
+            if row[0]:
+                return bytes(_decompress_blob(row[0]))
+            records = _loads_or(_decompress_blob(row[1]), [])
+            if not records:
+                return None
+            return _snapshot_payload(_dumps_bytes(records), share_id)
+
+        try:
+            return await self._read_snapshot(
+                "SELECT payload_json, data FROM shared_snapshots WHERE share_id IN (?, ?) LIMIT 1",
+                keys,
+                decode,
+            )
         except Exception as e:
             print(f"❌ 读取分享快照失败: {e}")
-            return []
+            return None
     
     async def close(self):
-        """关闭数据库连接（在aiosqlite中不需要显式关闭）"""
-        pass
\ No newline at end of file
+        """停止后台任务，执行 PRAGMA optimize 后关闭写连接、只读连接池、保存对话用的同步连接与分享快照只读连接"""
+        for task in (self._code_writer_task, self._optimize_task, self._purge_codes_task):
+            if task is not None and not task.done():
+                task.cancel()
+        self._code_writer_task = None
+        # 写入任务尚未运行即被取消时不会走到其清理逻辑，这里兜底结束队列中的请求
+        self._fail_pending_codes(self._code_queue)
+        self._code_queue = None
+        self._optimize_task = None
+        self._purge_codes_task = None
+        db = self._db
+        self._db = None
+        if db is not None:
+            try:
+                await db.execute("PRAGMA optimize")
+            except Exception:
+                pass
+            try:
+                await db.close()
+            except Exception:
+                pass
+        reader_conns = list(self._reader_conns)
+        self._reader_conns.clear()
+        self._readers = None
+        for conn in reader_conns:
+            try:
+                await conn.close()
+            except Exception:
+                pass
+        sync_db = self._sync_db
+        self._sync_db = None
+        if sync_db is not None:
+            try:
+                sync_db.close()
+            except Exception:
+                pass
+        with self._ro_lock:
+            ro_db = self._ro_db
+            self._ro_db = None
+        if ro_db is not None:
+            try:
+                ro_db.close()
+            except Exception:
+                pass
\ No newline at end of file
@@ -33,8 +33,12 @@ from app_main.connection import ConnectionManager
 from app_main.ws_handlers import handle_ping, handle_pause, handle_resume_conversation
 from app_main.auth import auth_router, _auth_user_from_request, get_chat_db, JWT_SECRET, JWT_ALG
 from app_main.mcp_api import mcp_router, get_mcp_agent
+from app_main.db_pool import init_pool, close_pool, acquire_reader
 import jwt as pyjwt
 
+# 拼装模型上下文时只需要的历史字段（见 MessageProcessor），其余列不读取
+HISTORY_PROMPT_FIELDS = ("user_input", "attachments", "mcp_results", "ai_response")
+
 # 全局变量
 mcp_agent = None
 chat_db = None  # SQLite数据库实例
@@ -80,34 +84,14 @@ async def lifespan(app: FastAPI):
     
     # 设置认证模块的数据库依赖注入
     get_chat_db.instance = chat_db
-    # 确保用户自定义模型表存在（幂等）
+    # 确保用户自定义模型表存在（幂等，仅启动时执行一次）
     try:
-        import aiosqlite
-        async with aiosqlite.connect(chat_db.db_path) as _db:
-            await _db.execute(
-                """
-                CREATE TABLE IF NOT EXISTS user_models (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    profile_id TEXT,
-                    label TEXT NOT NULL,
-                    api_key TEXT NOT NULL,
-                    base_url TEXT,
-                    model TEXT NOT NULL,
-                    temperature REAL DEFAULT 0.2,
-                    timeout INTEGER DEFAULT 60,
-                    system_prompt TEXT,
-                    enabled INTEGER DEFAULT 1,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-                """
-            )
-            await _db.execute("CREATE INDEX IF NOT EXISTS idx_user_models_user ON user_models(user_id)")
-            await _db.execute("CREATE INDEX IF NOT EXISTS idx_user_models_profile ON user_models(user_id, profile_id)")
-            await _db.commit()
+        await init_user_models_schema(chat_db)
     except Exception as _e:
         print(f"⚠️ 初始化用户模型表失败: {_e}")
+
+    # 接口模块通过 db_pool 复用 ChatDatabase 的写连接与只读连接池（替代各接口的逐请求 connect）
+    init_pool(chat_db)
     
     # 初始化MCP智能体
     mcp_agent = WebMCPAgent()
@@ -134,6 +118,7 @@ async def lifespan(app: FastAPI):
         await mcp_agent.close()
     if chat_db:
         await chat_db.close()
+    close_pool()
     print("👋 MCP Web 智能助手已关闭")
 
 # 创建FastAPI应用
@@ -168,8 +153,8 @@ app.include_router(mcp_router)
 # 挂载API路由
 from app_main.api.upload_api import upload_router
 from app_main.api.status_api import status_router, init_status_dependencies
-from app_main.api.user_models_api import user_models_router, init_user_models_dependencies
-from app_main.api.history_api import history_router, init_history_dependencies
+from app_main.api.user_models_api import user_models_router, init_user_models_dependencies, init_user_models_schema
+from app_main.api.history_api import history_router, init_history_dependencies, invalidate_history_cache
 from app_main.api.share_api import share_router, init_share_dependencies
 app.include_router(upload_router)
 app.include_router(status_router)
@@ -263,13 +248,12 @@ async def websocket_chat(websocket: WebSocket):
                     try:
                         user_id = (session_ctx or {}).get("user_id")
                         if user_id:
-                            import aiosqlite
-                            async with aiosqlite.connect(chat_db.db_path) as db:
-                                cur = await db.execute(
+                            async with acquire_reader() as db:
+                                async with db.execute(
                                     "SELECT id, label, api_key, base_url, model, temperature, timeout, system_prompt, enabled FROM user_models WHERE id = ? AND user_id = ?",
                                     (int(str(model_param).split("-",1)[1]), int(user_id))
-                                )
-                                row = await cur.fetchone()
+                                ) as cur:
+                                    row = await cur.fetchone()
                                 if row and int(row[8]) == 1:
                                     cfg = {
                                         "id": f"user-{int(row[0])}",
@@ -445,13 +429,12 @@ async def websocket_chat(websocket: WebSocket):
                                 user_id = (session_ctx or {}).get("user_id")
                                 if not user_id:
                                     raise ValueError("missing user id")
-                                import aiosqlite
-                                async with aiosqlite.connect(chat_db.db_path) as db:
-                                    cur = await db.execute(
+                                async with acquire_reader() as db:
+                                    async with db.execute(
                                         "SELECT id, label, api_key, base_url, model, temperature, timeout, system_prompt, enabled FROM user_models WHERE id = ? AND user_id = ?",
                                         (int(new_model.split("-",1)[1]), int(user_id))
-                                    )
-                                    row = await cur.fetchone()
+                                    ) as cur:
+                                        row = await cur.fetchone()
                                     if not row or int(row[8]) != 1:
                                         raise ValueError("user model not found or disabled")
                                     cfg = {
@@ -495,7 +478,8 @@ async def websocket_chat(websocket: WebSocket):
                     history = await chat_db.get_chat_history(
                         session_id=effective_session_id_for_history,
                         limit=10,
-                        conversation_id=conversation_id_for_history
+                        conversation_id=conversation_id_for_history,
+                        fields=HISTORY_PROMPT_FIELDS
                     ) # 限制最近10条
 
                     # 启动后台任务消费流，允许外部 pause 取消
@@ -608,6 +592,8 @@ async def websocket_chat(websocket: WebSocket):
                                         attachments=attachments,
                                         usage=conversation_data.get("usage")
                                     )
+                                    # 新记录改变了翻页偏移，丢弃该会话已预取的历史窗口
+                                    invalidate_history_cache(effective_session_id_for_save)
                                     # 将新记录ID回传给前端，便于即时挂载操作按钮
                                     try:
                                         await manager.send_personal_message({
@@ -678,6 +664,7 @@ async def websocket_chat(websocket: WebSocket):
                         # 先删除后续记录
                         try:
                             ok = await chat_db.delete_records_after(target_session, int(target_conv), int(from_record_id))
+                            invalidate_history_cache(target_session)
                             if not ok:
                                 await manager.send_personal_message({
                                     "type": "edit_error",
@@ -752,7 +739,8 @@ async def websocket_chat(websocket: WebSocket):
                         history = await chat_db.get_chat_history(
                             session_id=target_session,
                             limit=10,
-                            conversation_id=int(target_conv)
+                            conversation_id=int(target_conv),
+                            fields=HISTORY_PROMPT_FIELDS
                         )
                         async def stream_and_persist_edit():
                             try:
@@ -822,6 +810,7 @@ async def websocket_chat(websocket: WebSocket):
                                             attachments=[{"filename": "(edited)"}],  # 保留字段结构，后续可扩展
                                             usage=conversation_data.get("usage")
                                         )
+                                        invalidate_history_cache(target_session)
                                         try:
                                             await manager.send_personal_message({
                                                 "type": "record_saved",
@@ -461,25 +461,16 @@ class WebMCPAgent:
                     user_map = self.session_contexts.get(session_id, {}).get("user_models") or {}
                     cfg = user_map.get(profile_id)
                     if cfg:
-                        prev_key = os.getenv("OPENAI_API_KEY")
-                        prev_base = os.getenv("OPENAI_BASE_URL")
-                        try:
-                            if cfg.get("api_key"):
-                                os.environ["OPENAI_API_KEY"] = cfg["api_key"]
-                            if cfg.get("base_url"):
-                                os.environ["OPENAI_BASE_URL"] = cfg["base_url"]
-                            _base = ChatOpenAI(
-                                model=cfg.get("model", self.model_name),
-                                temperature=cfg.get("temperature", self.temperature),
-                                timeout=cfg.get("timeout", self.timeout),
-                                max_retries=3,
-                            )
-                            current_llm_tools = _base.bind_tools(self.tools)
-                        finally:
-                            if prev_key is not None:
-                                os.environ["OPENAI_API_KEY"] = prev_key
-                            if prev_base is not None:
-                                os.environ["OPENAI_BASE_URL"] = prev_base
+                        # api_key/base_url 显式传入（未配置时由客户端回退到环境变量），不改写进程级 os.environ
+                        _cred = {k: cfg[k] for k in ("api_key", "base_url") if cfg.get(k)}
+                        _base = ChatOpenAI(
+                            model=cfg.get("model", self.model_name),
+                            temperature=cfg.get("temperature", self.temperature),
+                            timeout=cfg.get("timeout", self.timeout),
+                            max_retries=3,
+                            **_cred,
+                        )
+                        current_llm_tools = _base.bind_tools(self.tools)
             except Exception as __e:
                 print(f"⚠️ 用户自定义模型绑定工具失败: {__e}")
                 current_llm_tools = None
@@ -244,34 +244,23 @@ class ModelManager:
 
         cfg = self.llm_profiles[pid]
 
-        # 临时切换环境变量，构造实例
-        prev_key = os.getenv("OPENAI_API_KEY")
-        prev_base = os.getenv("OPENAI_BASE_URL")
-        try:
-            if cfg.get("api_key"):
-                os.environ["OPENAI_API_KEY"] = cfg["api_key"]
-            if cfg.get("base_url"):
-                os.environ["OPENAI_BASE_URL"] = cfg["base_url"]
-
-            base_llm = ChatOpenAI(
-                model=cfg.get("model", self.model_name),
-                temperature=cfg.get("temperature", self.temperature),
-                timeout=cfg.get("timeout", self.timeout),
-                max_retries=3,
-            )
-            llm_nontool = ChatOpenAI(
-                model=cfg.get("model", self.model_name),
-                temperature=cfg.get("temperature", self.temperature),
-                timeout=cfg.get("timeout", self.timeout),
-                max_retries=3,
-            )
-            llm_tools = base_llm.bind_tools(tools)
-        finally:
-            # 还原环境，避免影响其他逻辑
-            if prev_key is not None:
-                os.environ["OPENAI_API_KEY"] = prev_key
-            if prev_base is not None:
-                os.environ["OPENAI_BASE_URL"] = prev_base
+        # api_key/base_url 显式传入构造实例（未配置时由客户端回退到环境变量），不改写 os.environ
+        cred = {k: cfg[k] for k in ("api_key", "base_url") if cfg.get(k)}
+        base_llm = ChatOpenAI(
+            model=cfg.get("model", self.model_name),
+            temperature=cfg.get("temperature", self.temperature),
+            timeout=cfg.get("timeout", self.timeout),
+            max_retries=3,
+            **cred,
+        )
+        llm_nontool = ChatOpenAI(
+            model=cfg.get("model", self.model_name),
+            temperature=cfg.get("temperature", self.temperature),
+            timeout=cfg.get("timeout", self.timeout),
+            max_retries=3,
+            **cred,
+        )
+        llm_tools = base_llm.bind_tools(tools)
 
         bundle = {"llm": base_llm, "llm_nontool": llm_nontool, "llm_tools": llm_tools}
         self._llm_cache[pid] = bundle